@@ -5,12 +5,29 @@ from __future__ import annotations
 
 import argparse
 import json
+import sys
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from dataclasses import dataclass
 from datetime import datetime
+from itertools import islice
 from pathlib import Path
-from typing import Any
-
+from typing import Any, Iterable
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[3] / "scripts" / "ai"))
+
+from jsonl_io import DECODE_ERRORS, byte_ranges, imap_bounded, iter_lines, loads  # noqa: E402
+from sample_validator import SampleValidator  # noqa: E402
+from sequence_packing import (  # noqa: E402
+    TOKEN_BATCH_SIZE,
+    length_stats,
+    load_tokenizer,
+    pack_lengths,
+    packing_report,
+    token_lengths,
+    write_packed,
+)
 
 SYSTEM_PROMPT = (
     "你是端侧学习助手，优先本地处理请求。回答要简洁、结构化、可执行。\n"
@@ -27,6 +44,12 @@ class SplitStats:
     malformed_count: int = 0
     missing_field_count: int = 0
 
+    def merge(self, other: "SplitStats") -> None:
+        self.input_count += other.input_count
+        self.output_count += other.output_count
+        self.malformed_count += other.malformed_count
+        self.missing_field_count += other.missing_field_count
+
 
 def build_user_content(instruction: str, user_input: str) -> str:
     instruction = instruction.strip()
@@ -61,47 +84,86 @@ def convert_record(obj: dict[str, Any], sample_id: str) -> dict[str, Any]:
     }
 
 
+CHUNK_BYTES = 32 * 1024 * 1024
+
+
+def convert_chunk(
+    task: tuple[str, Path, int, int, int],
+) -> tuple[bytes, SplitStats, Counter[str], Counter[str], SampleValidator]:
+    """Convert one line range of a split; returns the encoded output lines and partial stats."""
+    split_name, input_path, start, end, first_line = task
+    stats = SplitStats()
+    task_counter: Counter[str] = Counter()
+    route_counter: Counter[str] = Counter()
+    validator = SampleValidator("edge-swift")
+    out: list[str] = []
+
+    for idx, raw in iter_lines(input_path, start=start, end=end, first_line=first_line):
+        stats.input_count += 1
+        if not raw:
+            stats.malformed_count += 1
+            continue
+        try:
+            obj = loads(raw)
+        except DECODE_ERRORS:
+            stats.malformed_count += 1
+            continue
+
+        sample_id = f"edge-{split_name}-{idx:06d}"
+        try:
+            record = convert_record(obj, sample_id)
+        except ValueError:
+            stats.missing_field_count += 1
+            continue
+
+        task_type = record["meta"].get("task_type", "")
+        route = record["meta"].get("route", "")
+        if task_type:
+            task_counter[task_type] += 1
+        if route:
+            route_counter[route] += 1
+
+        validator.update(record)
+        out.append(json.dumps(record, ensure_ascii=False) + "\n")
+        stats.output_count += 1
+
+    return "".join(out).encode("utf-8"), stats, task_counter, route_counter, validator
+
+
+def plan_split(split_name: str, input_path: Path, chunk_bytes: int = CHUNK_BYTES) -> list[tuple[str, Path, int, int, int]]:
+    return [(split_name, input_path, *span) for span in byte_ranges(input_path, chunk_bytes)]
+
+
 def convert_split(
     split_name: str,
     input_path: Path,
     output_path: Path,
-) -> tuple[SplitStats, Counter[str], Counter[str]]:
+    parts: Iterable[tuple[bytes, SplitStats, Counter[str], Counter[str], SampleValidator]] | None = None,
+) -> tuple[SplitStats, Counter[str], Counter[str], dict[str, Any]]:
+    """Write a split from its converted chunks, merged in file order.
+
+    ``parts`` are convert_chunk() results (possibly computed in a process
+    pool); without them the split is converted chunk by chunk in-process.
+    Merging in range order keeps line order, sample ids and counter key order
+    identical to a serial line-by-line run.
+    """
+    if parts is None:
+        parts = map(convert_chunk, plan_split(split_name, input_path))
     stats = SplitStats()
     task_counter: Counter[str] = Counter()
     route_counter: Counter[str] = Counter()
+    validator = SampleValidator("edge-swift")
 
     output_path.parent.mkdir(parents=True, exist_ok=True)
-    with input_path.open("r", encoding="utf-8") as src, output_path.open("w", encoding="utf-8") as dst:
-        for idx, line in enumerate(src, start=1):
-            stats.input_count += 1
-            raw = line.strip()
-            if not raw:
-                stats.malformed_count += 1
-                continue
-            try:
-                obj = json.loads(raw)
-            except json.JSONDecodeError:
-                stats.malformed_count += 1
-                continue
-
-            sample_id = f"edge-{split_name}-{idx:06d}"
-            try:
-                record = convert_record(obj, sample_id)
-            except ValueError:
-                stats.missing_field_count += 1
-                continue
-
-            task_type = record["meta"].get("task_type", "")
-            route = record["meta"].get("route", "")
-            if task_type:
-                task_counter[task_type] += 1
-            if route:
-                route_counter[route] += 1
-
-            dst.write(json.dumps(record, ensure_ascii=False) + "\n")
-            stats.output_count += 1
-
-    return stats, task_counter, route_counter
+    with output_path.open("wb") as dst:
+        for data, part_stats, part_tasks, part_routes, part_validator in parts:
+            dst.write(data)
+            stats.merge(part_stats)
+            task_counter.update(part_tasks)
+            route_counter.update(part_routes)
+            validator.merge(part_validator)
+
+    return stats, task_counter, route_counter, validator.report()
 
 
 def default_report_path() -> Path:
@@ -129,6 +191,22 @@ def parse_args() -> argparse.Namespace:
         default=default_report_path(),
         help="Validation report path (json)",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Convert splits concurrently, chunking large ones over N processes; output is identical to a serial run.",
+    )
+    parser.add_argument(
+        "--tokenizer",
+        default=None,
+        help="Tokenizer name/path; adds per-split token-length histograms, a packing report and train.packed.jsonl",
+    )
+    parser.add_argument("--max-length", type=int, default=2048, help="Sequence length for the packing report")
+    parser.add_argument("--token-batch-size", type=int, default=TOKEN_BATCH_SIZE, help="Rows per tokenizer call")
+    parser.add_argument(
+        "--chunk-mb", type=int, default=CHUNK_BYTES // (1024 * 1024), help="Chunk size in MiB per conversion task."
+    )
     return parser.parse_args()
 
 
@@ -143,6 +221,21 @@ def main() -> None:
         "test": ("test.jsonl", "test.jsonl"),
     }
 
+    for input_file, _ in mapping.values():
+        if not (args.input_dir / input_file).exists():
+            raise FileNotFoundError(f"missing input file: {args.input_dir / input_file}")
+
+    # Chunks of all splits form one ordered task stream, so splits convert concurrently;
+    # at most two chunks per worker are in flight and each split takes its parts in file order.
+    chunk_bytes = args.chunk_mb * 1024 * 1024
+    plans = {
+        split_name: plan_split(split_name, args.input_dir / input_file, chunk_bytes)
+        for split_name, (input_file, _) in mapping.items()
+    }
+    all_tasks = [task for tasks in plans.values() for task in tasks]
+
+    tokenizer = load_tokenizer(args.tokenizer) if args.tokenizer else None
+
     split_results: dict[str, dict[str, Any]] = {}
     aggregate_task_counter: Counter[str] = Counter()
     aggregate_route_counter: Counter[str] = Counter()
@@ -151,30 +244,46 @@ def main() -> None:
     total_malformed = 0
     total_missing = 0
 
-    for split_name, (input_file, output_file) in mapping.items():
-        input_path = args.input_dir / input_file
-        output_path = args.output_dir / output_file
-        if not input_path.exists():
-            raise FileNotFoundError(f"missing input file: {input_path}")
-
-        stats, task_counter, route_counter = convert_split(split_name, input_path, output_path)
-        total_input += stats.input_count
-        total_output += stats.output_count
-        total_malformed += stats.malformed_count
-        total_missing += stats.missing_field_count
-        aggregate_task_counter.update(task_counter)
-        aggregate_route_counter.update(route_counter)
-
-        split_results[split_name] = {
-            "input_file": str(input_path),
-            "output_file": str(output_path),
-            "input_count": stats.input_count,
-            "output_count": stats.output_count,
-            "malformed_count": stats.malformed_count,
-            "missing_field_count": stats.missing_field_count,
-            "task_type_distribution": dict(task_counter),
-            "route_distribution": dict(route_counter),
-        }
+    pool_context = ProcessPoolExecutor(max_workers=args.workers) if args.workers > 1 else nullcontext()
+    with pool_context as pool:
+        if pool is not None:
+            results = imap_bounded(pool, convert_chunk, all_tasks, window=2 * args.workers)
+        else:
+            results = map(convert_chunk, all_tasks)
+
+        for split_name, (input_file, output_file) in mapping.items():
+            input_path = args.input_dir / input_file
+            output_path = args.output_dir / output_file
+            parts = islice(results, len(plans[split_name]))
+            stats, task_counter, route_counter, validation = convert_split(split_name, input_path, output_path, parts)
+            total_input += stats.input_count
+            total_output += stats.output_count
+            total_malformed += stats.malformed_count
+            total_missing += stats.missing_field_count
+            aggregate_task_counter.update(task_counter)
+            aggregate_route_counter.update(route_counter)
+
+            split_results[split_name] = {
+                "input_file": str(input_path),
+                "output_file": str(output_path),
+                "input_count": stats.input_count,
+                "output_count": stats.output_count,
+                "malformed_count": stats.malformed_count,
+                "missing_field_count": stats.missing_field_count,
+                "task_type_distribution": dict(task_counter),
+                "route_distribution": dict(route_counter),
+                "validation": validation,
+            }
+
+            if tokenizer is not None:
+                lengths = token_lengths(output_path, tokenizer, batch_size=args.token_batch_size)
+                bins = pack_lengths(lengths, args.max_length)
+                split_results[split_name]["token_lengths"] = length_stats(lengths, args.max_length)
+                split_results[split_name]["packing"] = packing_report(lengths, args.max_length, bins)
+                if split_name == "train":
+                    packed_path = output_path.with_name("train.packed.jsonl")
+                    write_packed(output_path, packed_path, bins, lengths, args.max_length, f"edge-{split_name}-pack")
+                    split_results[split_name]["packing"]["packed_file"] = str(packed_path)
 
     report = {
         "generated_at": datetime.now().isoformat(timespec="seconds"),
@@ -190,6 +299,7 @@ def main() -> None:
             "task_type_distribution": dict(aggregate_task_counter),
             "route_distribution": dict(aggregate_route_counter),
         },
+        "tokenizer": args.tokenizer,
         "splits": split_results,
     }
 
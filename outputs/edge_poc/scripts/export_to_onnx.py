@@ -10,18 +10,69 @@
 import torch
 import argparse
 from pathlib import Path
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer
 import onnx
 import onnxruntime as ort
 import numpy as np
+import inspect
 import json
+import sys
+from transformers import DynamicCache
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[3] / "scripts" / "ai"))
+from jsonl_io import JsonlDataset
+from length_buckets import bucket_for, build_feeds, pad_batch, parse_buckets
+from onnx_optimize import OPTIMIZER_MODEL_TYPE, QueryCalibrationReader, optimize_graph, quantize_int8_qdq, stage_paths, stage_summary
+
+
+def legacy_export_kwargs() -> dict:
+    """导出依赖 TorchScript 导出器的 opset / dynamic_axes 语义；新版 torch 默认走 dynamo，需显式关闭"""
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        return {"dynamo": False}
+    return {}
+
+
+LOGITS_MODES = ("all", "last", "selected")
+
+
+def last_token_positions(attention_mask):
+    """每行最后一个有效 token 的下标，形状 [batch, 1]（右侧 padding 时不是 -1）"""
+    return (attention_mask.long().sum(-1, keepdim=True) - 1).clamp(min=0)
+
+
+class LogitsExport(torch.nn.Module):
+    """
+    只输出需要位置的 logits：decoder 得到 hidden states 后先按位置 gather，
+    再过 lm_head，避免在图内分配 [batch, seq, vocab] 的完整 logits。
+
+    mode:
+        all: [batch, seq, vocab]，与原始导出一致
+        last: [batch, 1, vocab]，取每行最后一个有效 token
+        selected: [batch, k, vocab]，由额外输入 logit_positions [batch, k] 指定
+    """
+
+    def __init__(self, model, mode: str = "all"):
+        super().__init__()
+        self.decoder = model.get_decoder()
+        self.lm_head = model.get_output_embeddings()
+        self.mode = mode
+
+    def forward(self, input_ids, attention_mask, logit_positions=None):
+        hidden = self.decoder(input_ids=input_ids, attention_mask=attention_mask, use_cache=False).last_hidden_state
+        if self.mode == "all":
+            return self.lm_head(hidden)
+        if self.mode == "last":
+            logit_positions = last_token_positions(attention_mask)
+        index = logit_positions.unsqueeze(-1).expand(-1, -1, hidden.shape[-1])
+        return self.lm_head(torch.gather(hidden, 1, index))
 
 
 def export_to_onnx(
     model_path: str,
     output_path: str,
     opset_version: int = 14,
-    max_length: int = 128
+    max_length: int = 128,
+    logits_mode: str = "all"
 ):
     """
     导出模型到 ONNX 格式
@@ -31,6 +82,7 @@ def export_to_onnx(
         output_path: 输出 ONNX 文件路径
         opset_version: ONNX opset 版本
         max_length: 最大序列长度
+        logits_mode: all / last / selected，见 LogitsExport
     """
     print(f"Loading model from {model_path}...")
 
@@ -45,33 +97,42 @@ def export_to_onnx(
     # 设置为评估模式
     model.eval()
 
-    # 准备示例输入
+    # 准备示例输入（真实长度，不补齐到 max_length；序列维由 dynamic_axes 声明为动态）
     dummy_text = "Hello, how are you?"
     dummy_input = tokenizer(
         dummy_text,
         return_tensors="pt",
         max_length=max_length,
-        padding="max_length",
         truncation=True
     )
 
-    print(f"Exporting to ONNX (opset {opset_version})...")
+    input_names = ["input_ids", "attention_mask"]
+    inputs = (dummy_input["input_ids"], dummy_input["attention_mask"])
+    dynamic_axes = {
+        "input_ids": {0: "batch_size", 1: "sequence_length"},
+        "attention_mask": {0: "batch_size", 1: "sequence_length"},
+        "logits": {0: "batch_size", 1: "sequence_length"} if logits_mode == "all" else {0: "batch_size"}
+    }
+    if logits_mode == "selected":
+        dynamic_axes["logits"][1] = "num_positions"
+        input_names.append("logit_positions")
+        inputs += (last_token_positions(dummy_input["attention_mask"]),)
+        dynamic_axes["logit_positions"] = {0: "batch_size", 1: "num_positions"}
+
+    print(f"Exporting to ONNX (opset {opset_version}, logits {logits_mode})...")
 
     # 导出到 ONNX
     torch.onnx.export(
-        model,
-        (dummy_input["input_ids"], dummy_input["attention_mask"]),
+        LogitsExport(model, logits_mode),
+        inputs,
         output_path,
         opset_version=opset_version,
-        input_names=["input_ids", "attention_mask"],
+        input_names=input_names,
         output_names=["logits"],
-        dynamic_axes={
-            "input_ids": {0: "batch_size", 1: "sequence_length"},
-            "attention_mask": {0: "batch_size", 1: "sequence_length"},
-            "logits": {0: "batch_size", 1: "sequence_length"}
-        },
+        dynamic_axes=dynamic_axes,
         do_constant_folding=True,
-        verbose=False
+        verbose=False,
+        **legacy_export_kwargs()
     )
 
     print(f"ONNX model exported to {output_path}")
@@ -92,7 +153,8 @@ def export_to_onnx(
         "onnx_size_mb": round(onnx_size, 2),
         "opset_version": opset_version,
         "max_length": max_length,
-        "input_names": ["input_ids", "attention_mask"],
+        "logits_mode": logits_mode,
+        "input_names": input_names,
         "output_names": ["logits"]
     }
 
@@ -103,79 +165,566 @@ def export_to_onnx(
     return output_path
 
 
-def validate_onnx_inference(
+class KVCacheStep(torch.nn.Module):
+    """
+    把 causal LM 包装成扁平 KV 输入输出的一步推理：
+    (input_ids, attention_mask, *past) -> (logits, *present)
+
+    past/present 按层展开为 key, value 交替的 [batch, kv_heads, seq, head_dim]。
+    position_ids 由 attention_mask 累加得到，左侧 padding 时位置依旧正确。
+    last_only 时只对最后一个位置过 lm_head（prompt 需左侧 padding）。
+    """
+
+    def __init__(self, model, last_only: bool = False):
+        super().__init__()
+        self.decoder = model.get_decoder()
+        self.lm_head = model.get_output_embeddings()
+        self.last_only = last_only
+
+    def forward(self, input_ids, attention_mask, *past):
+        cache = DynamicCache()
+        for layer_idx in range(len(past) // 2):
+            cache.update(past[2 * layer_idx], past[2 * layer_idx + 1], layer_idx)
+        position_ids = (attention_mask.long().cumsum(-1) - 1).clamp(min=0)[:, -input_ids.shape[1]:]
+        outputs = self.decoder(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=cache,
+            use_cache=True,
+        )
+        hidden = outputs.last_hidden_state
+        logits = self.lm_head(hidden[:, -1:] if self.last_only else hidden)
+        cache = outputs.past_key_values
+        if hasattr(cache, "layers"):
+            pairs = [(layer.keys, layer.values) for layer in cache.layers]
+        else:  # transformers < 4.56
+            pairs = list(zip(cache.key_cache, cache.value_cache))
+        present = [tensor for pair in pairs for tensor in pair]
+        return (logits, *present)
+
+
+def kv_cache_names(num_layers: int):
+    """按 HF/optimum 约定生成 past_key_values.{i}.key / present.{i}.key 等张量名"""
+    past = [f"past_key_values.{i}.{kind}" for i in range(num_layers) for kind in ("key", "value")]
+    present = [f"present.{i}.{kind}" for i in range(num_layers) for kind in ("key", "value")]
+    return past, present
+
+
+def kv_cache_paths(output_path: str):
+    """model.onnx -> (model_prefill.onnx, model_decode.onnx)"""
+    path = Path(output_path)
+    return (
+        str(path.with_name(f"{path.stem}_prefill{path.suffix}")),
+        str(path.with_name(f"{path.stem}_decode{path.suffix}")),
+    )
+
+
+def export_kv_cache(
     model_path: str,
-    onnx_path: str,
+    output_path: str,
+    opset_version: int = 14,
+    max_length: int = 128,
+    logits_mode: str = "all"
+):
+    """
+    导出带 KV cache 的 prefill / decode 两张图
+
+    prefill 图处理整段 prompt 并输出 present；decode 图每次只喂 1 个新 token
+    和上一步的 past_key_values，生成延迟随新 token 数而非总上下文增长。
+
+    Args:
+        model_path: 输入模型路径
+        output_path: ONNX 路径前缀（model.onnx -> model_prefill.onnx / model_decode.onnx）
+        opset_version: ONNX opset 版本
+        max_length: 示例 prompt 的最大长度
+        logits_mode: last 时 prefill 图只输出最后位置的 logits（decode 图本就只有 1 个位置）
+    """
+    print(f"Loading model from {model_path}...")
+    model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=torch.float32)
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    model.eval()
+    step = KVCacheStep(model, last_only=logits_mode == "last")
+
+    config = model.config
+    num_layers = config.num_hidden_layers
+    num_kv_heads = getattr(config, "num_key_value_heads", None) or config.num_attention_heads
+    head_dim = getattr(config, "head_dim", None) or config.hidden_size // config.num_attention_heads
+    past_names, present_names = kv_cache_names(num_layers)
+    prefill_path, decode_path = kv_cache_paths(output_path)
+
+    dummy_input = tokenizer(
+        "Hello, how are you?",
+        return_tensors="pt",
+        max_length=max_length,
+        truncation=True
+    )
+    input_ids = dummy_input["input_ids"]
+    attention_mask = dummy_input["attention_mask"]
+    prompt_len = input_ids.shape[1]
+
+    print(f"Exporting prefill graph (opset {opset_version})...")
+    torch.onnx.export(
+        step,
+        (input_ids, attention_mask),
+        prefill_path,
+        opset_version=opset_version,
+        input_names=["input_ids", "attention_mask"],
+        output_names=["logits"] + present_names,
+        dynamic_axes={
+            "input_ids": {0: "batch_size", 1: "sequence_length"},
+            "attention_mask": {0: "batch_size", 1: "sequence_length"},
+            "logits": {0: "batch_size", 1: "sequence_length"} if logits_mode == "all" else {0: "batch_size"},
+            **{name: {0: "batch_size", 2: "sequence_length"} for name in present_names},
+        },
+        do_constant_folding=True,
+        verbose=False,
+        **legacy_export_kwargs()
+    )
+
+    print(f"Exporting decode graph (opset {opset_version})...")
+    past = [torch.zeros(1, num_kv_heads, prompt_len, head_dim) for _ in past_names]
+    torch.onnx.export(
+        step,
+        (input_ids[:, -1:], torch.ones(1, prompt_len + 1, dtype=attention_mask.dtype), *past),
+        decode_path,
+        opset_version=opset_version,
+        input_names=["input_ids", "attention_mask"] + past_names,
+        output_names=["logits"] + present_names,
+        dynamic_axes={
+            "input_ids": {0: "batch_size"},
+            "attention_mask": {0: "batch_size", 1: "total_sequence_length"},
+            "logits": {0: "batch_size"},
+            **{name: {0: "batch_size", 2: "past_sequence_length"} for name in past_names},
+            **{name: {0: "batch_size", 2: "total_sequence_length"} for name in present_names},
+        },
+        do_constant_folding=True,
+        verbose=False,
+        **legacy_export_kwargs()
+    )
+
+    print("Validating ONNX models...")
+    for path in (prefill_path, decode_path):
+        onnx.checker.check_model(onnx.load(path))
+    print("ONNX models are valid")
+
+    sizes = {
+        name: round(Path(path).stat().st_size / 1024 / 1024, 2)
+        for name, path in (("prefill", prefill_path), ("decode", decode_path))
+    }
+    print(f"ONNX model size: prefill {sizes['prefill']:.2f} MB, decode {sizes['decode']:.2f} MB")
+
+    report = {
+        "mode": "kv_cache",
+        "logits_mode": logits_mode,
+        "prefill_path": prefill_path,
+        "decode_path": decode_path,
+        "onnx_size_mb": sizes,
+        "opset_version": opset_version,
+        "max_length": max_length,
+        "num_layers": num_layers,
+        "num_kv_heads": num_kv_heads,
+        "head_dim": head_dim,
+        "prefill": {"input_names": ["input_ids", "attention_mask"], "output_names": ["logits"] + present_names},
+        "decode": {"input_names": ["input_ids", "attention_mask"] + past_names, "output_names": ["logits"] + present_names},
+    }
+
+    report_path = Path(output_path).parent / "onnx_export_report.json"
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    return prefill_path, decode_path
+
+
+def generate_with_kv_cache(
+    prefill_session,
+    decode_session,
+    input_ids: np.ndarray,
+    attention_mask: np.ndarray,
+    max_new_tokens: int
+) -> np.ndarray:
+    """
+    用 prefill + decode 两张图做贪心生成
+
+    prompt 只跑一次，之后每步只喂新 token 与上一步的 present。
+    返回新生成的 token，形状 [batch, max_new_tokens]。
+    """
+    past_names = [i.name for i in decode_session.get_inputs()][2:]
+    outputs = prefill_session.run(None, {"input_ids": input_ids, "attention_mask": attention_mask})
+    generated = []
+    for _ in range(max_new_tokens):
+        logits, present = outputs[0], outputs[1:]
+        next_tokens = logits[:, -1, :].argmax(-1)[:, None].astype(input_ids.dtype)
+        generated.append(next_tokens)
+        attention_mask = np.concatenate([attention_mask, np.ones_like(next_tokens, dtype=attention_mask.dtype)], axis=1)
+        feeds = {"input_ids": next_tokens, "attention_mask": attention_mask}
+        feeds.update(zip(past_names, present))
+        outputs = decode_session.run(None, feeds)
+    return np.concatenate(generated, axis=1)
+
+
+def greedy_reference(model, input_ids, attention_mask, max_new_tokens: int) -> np.ndarray:
+    """
+    PyTorch 侧的对照解码：与 generate_with_kv_cache 相同的纯 argmax 循环
+
+    不走 generate()，避免 generation_config.json 里的 repetition_penalty 等
+    logits processor 与 EOS 处理让两边比较的不是同一个解码器。
+    """
+    generated = []
+    past_key_values = None
+    step_ids = input_ids
+    for _ in range(max_new_tokens):
+        outputs = model(
+            input_ids=step_ids,
+            attention_mask=attention_mask,
+            past_key_values=past_key_values,
+            use_cache=True
+        )
+        past_key_values = outputs.past_key_values
+        step_ids = outputs.logits[:, -1, :].argmax(-1, keepdim=True)
+        generated.append(step_ids)
+        attention_mask = torch.cat([attention_mask, torch.ones_like(step_ids, dtype=attention_mask.dtype)], dim=1)
+    return torch.cat(generated, dim=1).numpy()
+
+
+def validate_kv_cache(
+    model_path: str,
+    output_path: str,
     test_data_path: str,
-    num_samples: int = 10
+    num_samples: int = 10,
+    sample_seed: int = None,
+    max_new_tokens: int = 16
 ):
     """
-    验证 ONNX 推理一致性
+    验证 KV cache 图的贪心生成与 PyTorch 贪心解码逐 token 一致
+
+    两边都固定生成 max_new_tokens 个 token，不在 EOS 处停止，也不套用 generation_config。
 
     Args:
         model_path: 原始 PyTorch 模型路径
-        onnx_path: ONNX 模型路径
+        output_path: 导出时使用的 ONNX 路径前缀
         test_data_path: 测试数据路径
         num_samples: 测试样本数量
+        sample_seed: 随机抽样种子（为空时取前 num_samples 条）
+        max_new_tokens: 每条样本生成的 token 数
     """
-    print("\nValidating ONNX inference consistency...")
+    print("\nValidating KV-cache generation consistency...")
 
-    # 加载 PyTorch 模型
     pytorch_model = AutoModelForCausalLM.from_pretrained(model_path)
     tokenizer = AutoTokenizer.from_pretrained(model_path)
     pytorch_model.eval()
 
-    # 加载 ONNX 模型
-    ort_session = ort.InferenceSession(onnx_path)
-
-    # 加载测试数据
-    test_samples = []
-    with open(test_data_path, 'r') as f:
-        for line in f:
-            test_samples.append(json.loads(line))
-
-    # 比较输出
-    matches = 0
-    total = min(len(test_samples), num_samples)
-
-    for i, sample in enumerate(test_samples[:total]):
-        query = sample["query"]
-        inputs = tokenizer(
-            query,
-            return_tensors="pt",
-            max_length=128,
-            padding="max_length",
-            truncation=True
+    prefill_path, decode_path = kv_cache_paths(output_path)
+    prefill_session = ort.InferenceSession(prefill_path)
+    decode_session = ort.InferenceSession(decode_path)
+
+    with JsonlDataset(Path(test_data_path)) as dataset:
+        test_samples = dataset.take(num_samples, seed=sample_seed)
+
+    matched_tokens = 0
+    total_tokens = 0
+    for sample in test_samples:
+        inputs = tokenizer(sample["query"], return_tensors="pt", max_length=128, truncation=True)
+        with torch.no_grad():
+            reference = greedy_reference(
+                pytorch_model,
+                inputs["input_ids"],
+                inputs["attention_mask"],
+                max_new_tokens
+            )
+        onnx_tokens = generate_with_kv_cache(
+            prefill_session,
+            decode_session,
+            inputs["input_ids"].numpy(),
+            inputs["attention_mask"].numpy(),
+            max_new_tokens
         )
+        matched_tokens += int((reference == onnx_tokens).sum())
+        total_tokens += reference.size
+
+    consistency = matched_tokens / total_tokens * 100 if total_tokens else 0.0
+    print(f"\nKV-cache generation consistency: {consistency:.2f}% ({matched_tokens}/{total_tokens} tokens)")
+
+    return consistency
+
+
+VALIDATION_METRICS = (
+    "top1_agreement",
+    "topk_overlap",
+    "kl_divergence_mean",
+    "kl_divergence_max",
+    "max_abs_logit_error",
+    "mean_abs_logit_error",
+)
+
+
+def log_softmax(logits: np.ndarray) -> np.ndarray:
+    logits = logits.astype(np.float64)
+    shifted = logits - logits.max(-1, keepdims=True)
+    return shifted - np.log(np.exp(shifted).sum(-1, keepdims=True))
+
+
+def logit_metrics(reference: np.ndarray, candidate: np.ndarray, top_k: int = 5) -> dict:
+    """
+    逐行比较两组 [N, vocab] logits（整批向量化计算）
+
+    返回每行的 top-1 是否一致、top-k 重合比例、KL(reference || candidate)
+    以及 logits 的最大 / 平均绝对误差。
+    """
+    top_k = min(top_k, reference.shape[-1])
+    ref_topk = np.argpartition(-reference, top_k - 1, axis=-1)[:, :top_k]
+    cand_topk = np.argpartition(-candidate, top_k - 1, axis=-1)[:, :top_k]
+    ref_logp = log_softmax(reference)
+    cand_logp = log_softmax(candidate)
+    abs_error = np.abs(reference.astype(np.float64) - candidate)
+    return {
+        "top1": reference.argmax(-1) == candidate.argmax(-1),
+        "topk_overlap": (ref_topk[:, :, None] == cand_topk[:, None, :]).any(-1).sum(-1) / top_k,
+        "kl": (np.exp(ref_logp) * (ref_logp - cand_logp)).sum(-1),
+        "max_abs": abs_error.max(-1),
+        "mean_abs": abs_error.mean(-1),
+    }
+
+
+def summarize_metrics(rows: dict, top_k: int) -> dict:
+    """把逐行指标汇总为报告字段（百分比 / 均值 / 最大值）"""
+    total = len(rows["top1"])
+    if total == 0:
+        return {"samples": 0, "top_k": top_k}
+    return {
+        "samples": total,
+        "top_k": top_k,
+        "top1_agreement": round(float(rows["top1"].mean()) * 100, 2),
+        "topk_overlap": round(float(rows["topk_overlap"].mean()), 6),
+        "kl_divergence_mean": float(rows["kl"].mean()),
+        "kl_divergence_max": float(rows["kl"].max()),
+        "max_abs_logit_error": float(rows["max_abs"].max()),
+        "mean_abs_logit_error": float(rows["mean_abs"].mean()),
+    }
+
+
+def compare_onnx_models(
+    model_path: str,
+    onnx_paths: dict,
+    test_data_path: str,
+    num_samples: int = 10,
+    sample_seed: int = 0,
+    max_length: int = 128,
+    length_buckets=None,
+    batch_size: int = 16,
+    top_k: int = 5
+) -> dict:
+    """
+    批量对比 PyTorch 与一个或多个 ONNX 模型在最后有效位置上的 logits
+
+    样本按 token 长度排序后分批、右侧 padding 到批内最大长度（给定长度桶时补齐到
+    对应的桶），PyTorch 每批只跑一次（只对最后位置过 lm_head），结果同时与每个
+    ONNX 会话比较。
+
+    Args:
+        model_path: 原始 PyTorch 模型路径
+        onnx_paths: {名称: ONNX 路径}
+        test_data_path: 测试数据路径
+        num_samples: 抽样条数
+        sample_seed: 随机抽样种子（为空时取前 num_samples 条）
+        max_length: 截断长度
+        length_buckets: 长度桶（如 (16, 32, 64, 128)）；为空时按批内真实最大长度
+        batch_size: 每批样本数
+        top_k: top-k 重合度的 k
+
+    Returns:
+        {名称: 指标汇总}，见 summarize_metrics
+    """
+    pytorch_model = AutoModelForCausalLM.from_pretrained(model_path)
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    pytorch_model.eval()
+    reference_model = LogitsExport(pytorch_model, "last")
+    pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else 0
+
+    sessions = {name: ort.InferenceSession(path) for name, path in onnx_paths.items()}
+
+    # 加载测试数据（mmap + 行索引，只解码被抽中的样本）
+    with JsonlDataset(Path(test_data_path)) as dataset:
+        test_samples = dataset.take(num_samples, seed=sample_seed)
+
+    token_ids = [
+        tokenizer(sample["query"], max_length=max_length, truncation=True)["input_ids"]
+        for sample in test_samples
+    ]
+    order = sorted(range(len(token_ids)), key=lambda i: len(token_ids[i]))
+
+    rows = {name: [] for name in onnx_paths}
+    length_counts = {}
+    for start in range(0, len(order), batch_size):
+        batch = [token_ids[i] for i in order[start:start + batch_size]]
+        longest = max(max(len(ids) for ids in batch), 1)
+        seq_len = bucket_for(longest, length_buckets) if length_buckets else longest
+        length_counts[seq_len] = length_counts.get(seq_len, 0) + len(batch)
+        input_ids, attention_mask = pad_batch(batch, seq_len, pad_id)
 
-        # PyTorch 推理
         with torch.no_grad():
-            pytorch_outputs = pytorch_model(**inputs)
-            pytorch_logits = pytorch_outputs.logits.numpy()
+            reference = reference_model(torch.from_numpy(input_ids), torch.from_numpy(attention_mask))[:, -1].numpy()
+
+        last = np.maximum(attention_mask.sum(-1) - 1, 0)
+        for name, session in sessions.items():
+            logits = session.run(None, build_feeds(session, input_ids, attention_mask))[0]
+            # all 图输出整段序列，取最后有效位置；last/selected 图只有这一位置
+            logits = logits[np.arange(len(batch)), last] if logits.shape[1] == seq_len else logits[:, -1]
+            rows[name].append(logit_metrics(reference, logits, top_k))
+
+    results = {}
+    for name, batches in rows.items():
+        merged = {key: np.concatenate([b[key] for b in batches]) if batches else np.array([]) for key in
+                  ("top1", "topk_overlap", "kl", "max_abs", "mean_abs")}
+        results[name] = summarize_metrics(merged, top_k)
+        results[name].update({
+            "batch_size": batch_size,
+            "sample_seed": sample_seed,
+            "sequence_lengths": {str(k): v for k, v in sorted(length_counts.items())},
+        })
+    return results
 
-        # ONNX 推理
-        ort_inputs = {
-            "input_ids": inputs["input_ids"].numpy(),
-            "attention_mask": inputs["attention_mask"].numpy()
-        }
-        onnx_logits = ort_session.run(None, ort_inputs)[0]
 
-        # 比较 top-1 预测
-        pytorch_pred = np.argmax(pytorch_logits[0, -1, :])
-        onnx_pred = np.argmax(onnx_logits[0, -1, :])
+def validate_onnx_inference(
+    model_path: str,
+    onnx_path: str,
+    test_data_path: str,
+    num_samples: int = 10,
+    sample_seed: int = 0,
+    max_length: int = 128,
+    length_buckets=None,
+    batch_size: int = 16,
+    top_k: int = 5
+):
+    """
+    验证 ONNX 推理一致性（批量），参数见 compare_onnx_models
 
-        if pytorch_pred == onnx_pred:
-            matches += 1
+    Returns:
+        指标汇总（top-1 一致率、top-k 重合度、KL 散度、logits 最大绝对误差等）
+    """
+    print("\nValidating ONNX inference consistency...")
+    metrics = compare_onnx_models(
+        model_path,
+        {"onnx": onnx_path},
+        test_data_path,
+        num_samples=num_samples,
+        sample_seed=sample_seed,
+        max_length=max_length,
+        length_buckets=length_buckets,
+        batch_size=batch_size,
+        top_k=top_k
+    )["onnx"]
+    print_metrics("ONNX", metrics)
+    return metrics
+
+
+def print_metrics(name: str, metrics: dict):
+    if not metrics.get("samples"):
+        print(f"  {name}: no samples")
+        return
+    print(
+        f"  {name}: top-1 {metrics['top1_agreement']:.2f}%, "
+        f"top-{metrics['top_k']} overlap {metrics['topk_overlap']:.4f}, "
+        f"KL mean {metrics['kl_divergence_mean']:.3e} / max {metrics['kl_divergence_max']:.3e}, "
+        f"max |Δlogit| {metrics['max_abs_logit_error']:.4g} ({metrics['samples']} samples)"
+    )
+    print(f"    Sequence lengths used: {metrics['sequence_lengths']}")
 
-        # 计算 logits 差异
-        logits_diff = np.abs(pytorch_logits - onnx_logits).mean()
-        if i == 0:
-            print(f"  Sample {i+1}: logits diff = {logits_diff:.6f}")
 
-    consistency = matches / total * 100
-    print(f"\nONNX inference consistency: {consistency:.2f}% ({matches}/{total} matches)")
+def optimize_and_quantize(
+    model_path: str,
+    onnx_path: str,
+    test_data_path: str = None,
+    quantize: bool = False,
+    calibration_samples: int = 64,
+    calibration_seed: int = 0,
+    max_length: int = 128,
+    validate: bool = False,
+    num_samples: int = 10,
+    sample_seed: int = 0,
+    length_buckets=None,
+    batch_size: int = 16,
+    top_k: int = 5
+):
+    """
+    导出后的优化阶段：transformer 图优化 -> 静态 INT8 QDQ 量化（可选）
 
-    return consistency
+    每个阶段（export / optimized / int8_qdq）的大小、实际融合的算子与 Q/DQ 算子数写入
+    onnx_export_report.json 的 stages；validate 时各阶段在同一批样本上与 PyTorch
+    对比（见 compare_onnx_models），并记录各项指标相对 export 的差值。
+
+    Args:
+        model_path: 原始 PyTorch 模型路径
+        onnx_path: export_to_onnx 导出的 fp32 模型
+        test_data_path: 边缘测试集（量化校准与验证）
+        quantize: 是否做静态 INT8 量化
+        calibration_samples: 校准样本数
+        calibration_seed: 校准样本抽样种子
+        max_length: 截断长度
+        validate: 是否逐阶段验证一致率
+        num_samples / sample_seed / length_buckets / batch_size / top_k: 同 compare_onnx_models
+    """
+    config = AutoConfig.from_pretrained(model_path)
+    paths = {"export": onnx_path}
+    optimized_path = stage_paths(onnx_path)["optimized"]
+    paths["optimized"] = optimize_graph(onnx_path, optimized_path, config.num_attention_heads, config.hidden_size)
+
+    if quantize:
+        tokenizer = AutoTokenizer.from_pretrained(model_path)
+        calibration_reader = QueryCalibrationReader(
+            optimized_path,
+            tokenizer,
+            test_data_path,
+            num_samples=calibration_samples,
+            sample_seed=calibration_seed,
+            max_length=max_length
+        )
+        paths["int8_qdq"] = quantize_int8_qdq(optimized_path, stage_paths(onnx_path)["int8_qdq"], calibration_reader)
+
+    stages = {name: stage_summary(path) for name, path in paths.items()}
+    stages["optimized"]["optimizer_model_type"] = OPTIMIZER_MODEL_TYPE
+    if validate:
+        print("\nValidating stages against PyTorch...")
+        metrics = compare_onnx_models(
+            model_path,
+            paths,
+            test_data_path,
+            num_samples=num_samples,
+            sample_seed=sample_seed,
+            max_length=max_length,
+            length_buckets=length_buckets,
+            batch_size=batch_size,
+            top_k=top_k
+        )
+        for name, stage in stages.items():
+            print_metrics(name, metrics[name])
+            stage["validation"] = metrics[name]
+            if metrics[name].get("samples"):
+                stage["accuracy_delta"] = {
+                    key: metrics[name][key] - metrics["export"][key] for key in VALIDATION_METRICS
+                }
+    if quantize:
+        stages["int8_qdq"]["calibration"] = {
+            "data": str(test_data_path),
+            "samples": len(calibration_reader.feeds),
+            "seed": calibration_seed
+        }
+
+    print("\nStage summary:")
+    for name, stage in stages.items():
+        line = f"  {name}: {stage['size_mb']:.2f} MB, {stage['total_nodes']} nodes, fused {stage['fused_ops']}"
+        if "accuracy_delta" in stage:
+            delta = stage["accuracy_delta"]
+            line += f", top-1 {delta['top1_agreement']:+.2f}pt, KL mean {delta['kl_divergence_mean']:+.3e} vs export"
+        print(line)
+
+    report_path = Path(onnx_path).parent / "onnx_export_report.json"
+    report = json.loads(report_path.read_text()) if report_path.exists() else {}
+    report["stages"] = stages
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    return paths
 
 
 def main():
@@ -186,24 +735,114 @@ def main():
     parser.add_argument("--max_length", type=int, default=128, help="Maximum sequence length")
     parser.add_argument("--validate", action="store_true", help="Validate ONNX inference")
     parser.add_argument("--test_data", type=str, help="Test data path for validation")
+    parser.add_argument("--num_samples", type=int, default=10, help="Number of validation samples")
+    parser.add_argument(
+        "--sample_seed",
+        type=int,
+        default=0,
+        help="Seed for randomly sampling validation rows (negative: take the first --num_samples rows)"
+    )
+    parser.add_argument("--batch_size", type=int, default=16, help="Validation batch size")
+    parser.add_argument("--top_k", type=int, default=5, help="k for the top-k overlap metric")
+    parser.add_argument(
+        "--kv_cache",
+        action="store_true",
+        help="Export separate prefill/decode graphs with past_key_values inputs and present outputs"
+    )
+    parser.add_argument("--max_new_tokens", type=int, default=16, help="Tokens generated per sample in KV-cache validation")
+    parser.add_argument(
+        "--length_buckets",
+        type=str,
+        default="dynamic",
+        help="Validation input lengths: 'dynamic' (real token length) or buckets like 16,32,64,128"
+    )
+    parser.add_argument(
+        "--logits_mode",
+        choices=LOGITS_MODES,
+        default="all",
+        help="all: [batch, seq, vocab]; last: last valid position only; selected: positions given by a logit_positions input"
+    )
+    parser.add_argument(
+        "--optimize",
+        action="store_true",
+        help="Run the onnxruntime transformer optimizer (operator fusion) after export"
+    )
+    parser.add_argument(
+        "--quantize",
+        action="store_true",
+        help="Static INT8 QDQ quantization of the optimized graph, calibrated on --test_data (implies --optimize)"
+    )
+    parser.add_argument("--calibration_samples", type=int, default=64, help="Calibration rows drawn from --test_data")
+    parser.add_argument("--calibration_seed", type=int, default=0, help="Seed for sampling calibration rows")
 
     args = parser.parse_args()
+    if args.sample_seed is not None and args.sample_seed < 0:
+        args.sample_seed = None
+
+    if args.quantize and not args.test_data:
+        parser.error("--quantize needs --test_data for calibration")
+
+    if args.kv_cache:
+        if args.logits_mode == "selected":
+            parser.error("--kv_cache supports --logits_mode all or last")
+        if args.optimize or args.quantize:
+            parser.error("--optimize/--quantize apply to the single full-sequence graph, not --kv_cache")
+        export_kv_cache(args.model_path, args.output_path, args.opset_version, args.max_length, args.logits_mode)
+        if args.validate and args.test_data:
+            validate_kv_cache(
+                args.model_path,
+                args.output_path,
+                args.test_data,
+                num_samples=args.num_samples,
+                sample_seed=args.sample_seed,
+                max_new_tokens=args.max_new_tokens
+            )
+        return
 
     # 导出到 ONNX
     onnx_path = export_to_onnx(
         args.model_path,
         args.output_path,
         args.opset_version,
-        args.max_length
+        args.max_length,
+        args.logits_mode
     )
 
+    # 图优化与 INT8 量化（逐阶段记录大小、融合算子数与一致率）
+    if args.optimize or args.quantize:
+        optimize_and_quantize(
+            args.model_path,
+            onnx_path,
+            args.test_data,
+            quantize=args.quantize,
+            calibration_samples=args.calibration_samples,
+            calibration_seed=args.calibration_seed,
+            max_length=args.max_length,
+            validate=args.validate and bool(args.test_data),
+            num_samples=args.num_samples,
+            sample_seed=args.sample_seed,
+            length_buckets=parse_buckets(args.length_buckets),
+            batch_size=args.batch_size,
+            top_k=args.top_k
+        )
     # 验证推理一致性（如果指定）
-    if args.validate and args.test_data:
-        validate_onnx_inference(
+    elif args.validate and args.test_data:
+        metrics = validate_onnx_inference(
             args.model_path,
             onnx_path,
-            args.test_data
+            args.test_data,
+            num_samples=args.num_samples,
+            sample_seed=args.sample_seed,
+            max_length=args.max_length,
+            length_buckets=parse_buckets(args.length_buckets),
+            batch_size=args.batch_size,
+            top_k=args.top_k
         )
+        report_path = Path(onnx_path).parent / "onnx_export_report.json"
+        report = json.loads(report_path.read_text())
+        report["validation"] = metrics
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
 
 
 if __name__ == "__main__":
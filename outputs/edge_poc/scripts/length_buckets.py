@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+序列长度分桶与按桶缓存的 ONNX Runtime 会话
+
+短的路由 query 不再统一补齐到 128：按实际长度落入最小的桶（16/32/64/128），
+每个桶一个会话，并用 free dimension override 把 batch/sequence 维固定下来，
+CoreML 等需要静态形状的 EP 可以按桶各自编译。
+"""
+
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import onnxruntime as ort
+
+LENGTH_BUCKETS = (16, 32, 64, 128)
+
+
+def parse_buckets(spec: str) -> Optional[Tuple[int, ...]]:
+    """"16,32,64,128" -> (16, 32, 64, 128)；"dynamic" -> None（按真实长度运行）"""
+    if spec.strip().lower() == "dynamic":
+        return None
+    return tuple(sorted({int(part) for part in spec.split(",") if part.strip()}))
+
+
+def bucket_for(length: int, buckets: Sequence[int]) -> int:
+    """能容纳 length 的最小桶；超过最大桶时返回最大桶（调用方截断）"""
+    for bucket in buckets:
+        if length <= bucket:
+            return bucket
+    return buckets[-1]
+
+
+def pad_batch(
+    sequences: Iterable[Sequence[int]],
+    length: int,
+    pad_id: int = 0
+) -> Tuple[np.ndarray, np.ndarray]:
+    """右侧 padding（超长截断）到 length，返回 (input_ids, attention_mask)"""
+    sequences = [list(seq)[:length] for seq in sequences]
+    input_ids = np.full((len(sequences), length), pad_id, dtype=np.int64)
+    attention_mask = np.zeros((len(sequences), length), dtype=np.int64)
+    for row, seq in enumerate(sequences):
+        input_ids[row, :len(seq)] = seq
+        attention_mask[row, :len(seq)] = 1
+    return input_ids, attention_mask
+
+
+def build_feeds(session: ort.InferenceSession, input_ids: np.ndarray, attention_mask: np.ndarray) -> Dict:
+    """按会话的输入名组装 feed；selected logits 图额外需要 logit_positions（取最后有效位置）"""
+    feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+    if "logit_positions" in {i.name for i in session.get_inputs()}:
+        feeds["logit_positions"] = np.maximum(attention_mask.sum(-1, keepdims=True) - 1, 0).astype(np.int64)
+    return feeds
+
+
+class BucketedSessions:
+    """
+    每个长度桶一个 InferenceSession，首次使用时创建并缓存
+
+    buckets 为 None 时不分桶：单个动态形状会话，按真实长度运行。
+    """
+
+    def __init__(
+        self,
+        onnx_path: str,
+        providers: Optional[List[str]] = None,
+        buckets: Optional[Sequence[int]] = LENGTH_BUCKETS,
+        pad_id: int = 0
+    ):
+        self.onnx_path = onnx_path
+        self.providers = providers
+        self.buckets = tuple(buckets) if buckets else None
+        self.pad_id = pad_id
+        self._sessions: Dict[Optional[int], ort.InferenceSession] = {}
+
+    def session(self, bucket: Optional[int]) -> ort.InferenceSession:
+        if bucket not in self._sessions:
+            options = ort.SessionOptions()
+            if bucket is not None:
+                options.add_free_dimension_override_by_name("batch_size", 1)
+                options.add_free_dimension_override_by_name("sequence_length", bucket)
+            self._sessions[bucket] = ort.InferenceSession(self.onnx_path, options, providers=self.providers)
+        return self._sessions[bucket]
+
+    def prepare(self, token_ids: Sequence[int]) -> Tuple[Optional[int], np.ndarray, np.ndarray]:
+        """单条 token 序列 -> (桶, input_ids[1, L], attention_mask[1, L])"""
+        if self.buckets is None:
+            input_ids, attention_mask = pad_batch([token_ids], max(len(token_ids), 1), self.pad_id)
+            return None, input_ids, attention_mask
+        bucket = bucket_for(len(token_ids), self.buckets)
+        input_ids, attention_mask = pad_batch([token_ids], bucket, self.pad_id)
+        return bucket, input_ids, attention_mask
+
+    def run(self, token_ids: Sequence[int]) -> Tuple[Optional[int], List[np.ndarray]]:
+        bucket, input_ids, attention_mask = self.prepare(token_ids)
+        session = self.session(bucket)
+        return bucket, session.run(None, build_feeds(session, input_ids, attention_mask))
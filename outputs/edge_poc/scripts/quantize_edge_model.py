@@ -12,6 +12,10 @@ import argparse
 from pathlib import Path
 from transformers import AutoModelForCausalLM, AutoTokenizer
 import json
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[3] / "scripts" / "ai"))
+from jsonl_io import JsonlDataset
 
 
 def quantize_model(model_path: str, output_dir: str):
@@ -74,7 +78,13 @@ def quantize_model(model_path: str, output_dir: str):
     print(f"\nQuantized model saved to {output_dir}")
 
 
-def validate_quantization(original_path: str, quantized_path: str, test_data_path: str):
+def validate_quantization(
+    original_path: str,
+    quantized_path: str,
+    test_data_path: str,
+    num_samples: int = 10,
+    sample_seed: int = None
+):
     """
     验证量化后的精度损失
 
@@ -82,6 +92,8 @@ def validate_quantization(original_path: str, quantized_path: str, test_data_pat
         original_path: 原始模型路径
         quantized_path: 量化模型路径
         test_data_path: 测试数据路径
+        num_samples: 测试样本数量
+        sample_seed: 随机抽样种子（为空时取前 num_samples 条）
     """
     print("\nValidating quantization accuracy...")
 
@@ -90,17 +102,15 @@ def validate_quantization(original_path: str, quantized_path: str, test_data_pat
     quantized_model = AutoModelForCausalLM.from_pretrained(quantized_path)
     tokenizer = AutoTokenizer.from_pretrained(original_path)
 
-    # 加载测试数据
-    test_samples = []
-    with open(test_data_path, 'r') as f:
-        for line in f:
-            test_samples.append(json.loads(line))
+    # 加载测试数据（mmap + 行索引，只解码被抽中的样本）
+    with JsonlDataset(Path(test_data_path)) as dataset:
+        test_samples = dataset.take(num_samples, seed=sample_seed)
 
     # 比较输出
     matches = 0
-    total = min(len(test_samples), 10)  # 只测试前 10 个样本
+    total = len(test_samples)
 
-    for i, sample in enumerate(test_samples[:total]):
+    for i, sample in enumerate(test_samples):
         query = sample["query"]
         inputs = tokenizer(query, return_tensors="pt")
 
@@ -134,6 +144,8 @@ def main():
     parser.add_argument("--output_dir", type=str, required=True, help="Output directory")
     parser.add_argument("--validate", action="store_true", help="Validate quantization accuracy")
     parser.add_argument("--test_data", type=str, help="Test data path for validation")
+    parser.add_argument("--num_samples", type=int, default=10, help="Number of validation samples")
+    parser.add_argument("--sample_seed", type=int, default=None, help="Randomly sample validation rows with this seed")
 
     args = parser.parse_args()
 
@@ -142,7 +154,13 @@ def main():
 
     # 验证精度（如果指定）
     if args.validate and args.test_data:
-        validate_quantization(args.model_path, args.output_dir, args.test_data)
+        validate_quantization(
+            args.model_path,
+            args.output_dir,
+            args.test_data,
+            num_samples=args.num_samples,
+            sample_seed=args.sample_seed
+        )
 
 
 if __name__ == "__main__":
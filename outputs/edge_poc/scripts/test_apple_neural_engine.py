@@ -16,6 +16,11 @@ import argparse
 from pathlib import Path
 from typing import List, Dict
 import subprocess
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[3] / "scripts" / "ai"))
+from jsonl_io import JsonlDataset
+from length_buckets import LENGTH_BUCKETS, BucketedSessions, build_feeds, parse_buckets
 
 
 def get_available_providers():
@@ -47,20 +52,16 @@ def test_latency(
 
     latencies = []
 
+    feeds = build_feeds(session, input_ids, attention_mask)
+
     # 预热
     for _ in range(10):
-        session.run(None, {
-            "input_ids": input_ids,
-            "attention_mask": attention_mask
-        })
+        session.run(None, feeds)
 
     # 测试
     for i in range(num_runs):
         start_time = time.time()
-        outputs = session.run(None, {
-            "input_ids": input_ids,
-            "attention_mask": attention_mask
-        })
+        outputs = session.run(None, feeds)
         latency = (time.time() - start_time) * 1000  # ms
         latencies.append(latency)
 
@@ -89,6 +90,36 @@ def test_latency(
     return stats
 
 
+def test_latency_by_bucket(
+    sessions: BucketedSessions,
+    lengths: List[int],
+    num_runs: int = 100
+) -> Dict:
+    """
+    按长度桶分别测试延迟，并给出相对最大桶的加速比
+
+    Args:
+        sessions: 按桶缓存的会话
+        lengths: 要测试的序列长度（分桶时即各桶长度）
+        num_runs: 每个桶的测试运行次数
+
+    Returns:
+        {长度: 延迟统计 + speedup_vs_max}
+    """
+    results = {}
+    for length in lengths:
+        print(f"\n--- Sequence length {length} ---")
+        bucket, input_ids, attention_mask = sessions.prepare(np.random.randint(0, 1000, length).tolist())
+        results[length] = test_latency(sessions.session(bucket), input_ids, attention_mask, num_runs)
+
+    baseline = results[max(lengths)]["p50"]
+    print(f"\nLatency by sequence length (vs. {max(lengths)}):")
+    for length, stats in results.items():
+        stats["speedup_vs_max"] = round(baseline / stats["p50"], 3) if stats["p50"] else None
+        print(f"  {length:>4}: P50 {stats['p50']:.2f} ms, speedup x{stats['speedup_vs_max']}")
+    return {str(length): stats for length, stats in results.items()}
+
+
 def test_memory(
     session: ort.InferenceSession,
     input_ids: np.ndarray,
@@ -111,13 +142,11 @@ def test_memory(
 
     process = psutil.Process(os.getpid())
     memory_usage = []
+    feeds = build_feeds(session, input_ids, attention_mask)
 
     for i in range(num_runs):
         # 推理
-        outputs = session.run(None, {
-            "input_ids": input_ids,
-            "attention_mask": attention_mask
-        })
+        outputs = session.run(None, feeds)
 
         # 测量内存
         memory_mb = process.memory_info().rss / 1024 / 1024
@@ -144,54 +173,49 @@ def test_memory(
 
 
 def test_accuracy(
-    session: ort.InferenceSession,
+    sessions: BucketedSessions,
     test_data_path: str,
-    max_samples: int = 10
+    max_samples: int = 10,
+    max_length: int = 128
 ) -> Dict:
     """
     测试推理准确率
 
     Args:
-        session: ONNX Runtime 会话
+        sessions: 按长度桶缓存的会话（query 按真实长度落桶，不再统一补齐到 128）
         test_data_path: 测试数据路径
         max_samples: 最大测试样本数
+        max_length: 截断长度
 
     Returns:
         准确率统计信息
     """
     print(f"\nTesting accuracy ({max_samples} samples)...")
 
-    # 加载测试数据
-    test_samples = []
-    with open(test_data_path, 'r') as f:
-        for line in f:
-            test_samples.append(json.loads(line))
+    # 加载测试数据（mmap + 行索引，只解码前 max_samples 条）
+    with JsonlDataset(Path(test_data_path)) as dataset:
+        test_samples = dataset[:max_samples]
 
     # 简单的 tokenizer（用于演示）
     def simple_tokenize(text: str, max_length: int = 128):
         # 这里使用简单的字符级 tokenization
         # 实际应用中应该使用真实的 tokenizer
-        tokens = [ord(c) % 1000 for c in text[:max_length]]
-        tokens = tokens + [0] * (max_length - len(tokens))
-        return np.array([tokens], dtype=np.int64)
+        return [ord(c) % 1000 for c in text[:max_length]]
 
     correct = 0
-    total = min(len(test_samples), max_samples)
+    total = len(test_samples)
+    bucket_counts = {}
 
-    for i, sample in enumerate(test_samples[:total]):
+    for i, sample in enumerate(test_samples):
         query = sample["query"]
         expected_response = json.loads(sample["response"])
         expected_route = expected_response["route"]
 
-        # Tokenize
-        input_ids = simple_tokenize(query)
-        attention_mask = (input_ids != 0).astype(np.int64)
-
-        # 推理
-        outputs = session.run(None, {
-            "input_ids": input_ids,
-            "attention_mask": attention_mask
-        })
+        # Tokenize + 按长度桶推理
+        token_ids = simple_tokenize(query, max_length)
+        bucket, outputs = sessions.run(token_ids)
+        seq_len = bucket or len(token_ids)
+        bucket_counts[seq_len] = bucket_counts.get(seq_len, 0) + 1
 
         # 简单的路由判断（基于 logits）
         logits = outputs[0]
@@ -205,7 +229,8 @@ def test_accuracy(
     stats = {
         "accuracy": accuracy,
         "correct": correct,
-        "total": total
+        "total": total,
+        "sequence_lengths": {str(k): v for k, v in sorted(bucket_counts.items())}
     }
 
     print(f"\nAccuracy Statistics:")
@@ -261,6 +286,13 @@ def main():
     parser.add_argument("--test_data", type=str, help="Test data path")
     parser.add_argument("--num_runs", type=int, default=100, help="Number of test runs")
     parser.add_argument("--output_dir", type=str, default="outputs/edge_poc/reports", help="Output directory")
+    parser.add_argument("--max_length", type=int, default=128, help="Maximum sequence length")
+    parser.add_argument(
+        "--length_buckets",
+        type=str,
+        default=",".join(str(b) for b in LENGTH_BUCKETS),
+        help="Sequence length buckets with one cached session each, or 'dynamic' for real lengths on one session"
+    )
 
     args = parser.parse_args()
 
@@ -279,26 +311,31 @@ def main():
         selected_providers = ["CPUExecutionProvider"]
         print(f"\nWarning: CoreML not available, using CPU")
 
-    # 创建 ONNX Runtime 会话
+    # 创建 ONNX Runtime 会话（每个长度桶一个，首次使用时创建）
     print(f"\nLoading ONNX model from {args.onnx_path}...")
-    session = ort.InferenceSession(args.onnx_path, providers=selected_providers)
+    buckets = parse_buckets(args.length_buckets)
+    if buckets:
+        buckets = tuple(b for b in buckets if b < args.max_length) + (args.max_length,)
+    sessions = BucketedSessions(args.onnx_path, providers=selected_providers, buckets=buckets)
+    lengths = list(buckets or [b for b in LENGTH_BUCKETS if b < args.max_length] + [args.max_length])
 
-    # 准备测试输入
-    input_ids = np.random.randint(0, 1000, (1, 128), dtype=np.int64)
-    attention_mask = np.ones((1, 128), dtype=np.int64)
+    # 准备测试输入（最大长度，与分桶前的 [1, max_length] 基线一致）
+    bucket, input_ids, attention_mask = sessions.prepare(np.random.randint(0, 1000, args.max_length).tolist())
+    session = sessions.session(bucket)
 
     # 运行测试
     results = {}
 
-    # 1. 延迟测试
-    results["latency"] = test_latency(session, input_ids, attention_mask, args.num_runs)
+    # 1. 延迟测试（按长度桶，含最大长度）
+    results["latency_by_bucket"] = test_latency_by_bucket(sessions, lengths, args.num_runs)
+    results["latency"] = results["latency_by_bucket"][str(args.max_length)]
 
     # 2. 内存测试
     results["memory"] = test_memory(session, input_ids, attention_mask, args.num_runs // 2)
 
     # 3. 准确率测试（如果提供测试数据）
     if args.test_data:
-        results["accuracy"] = test_accuracy(session, args.test_data)
+        results["accuracy"] = test_accuracy(sessions, args.test_data, max_length=args.max_length)
 
     # 4. 功耗测试
     results["power"] = test_power_consumption()
@@ -308,7 +345,8 @@ def main():
         "onnx_path": args.onnx_path,
         "providers": selected_providers,
         "num_runs": args.num_runs,
-        "input_shape": [1, 128]
+        "input_shape": [1, args.max_length],
+        "length_buckets": list(buckets) if buckets else "dynamic"
     }
 
     report_path = output_dir / "m4_performance_report.json"
@@ -0,0 +1,152 @@
+"""Columnar (Parquet / Arrow IPC) storage for distilled prompt/response datasets.
+
+``mode`` and ``meta`` repeat across millions of rows, so they are stored as
+dictionary-encoded columns (``meta`` as its JSON text) and every format is
+compressed with zstd. ``id`` and ``source_id`` may be integers or strings in
+the JSONL input, so they are stored as JSON text too and decoded on read;
+rows round-trip with their original types. Readers project only the requested columns. pyarrow is
+an optional dependency and is imported on first use.
+"""
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Any, Iterator
+
+COLUMNAR_FORMATS = ("parquet", "arrow")
+COLUMNAR_SUFFIXES = {".parquet": "parquet", ".arrow": "arrow", ".arrows": "arrow"}
+COLUMNS = ("id", "mode", "prompt", "response", "meta", "source_id")
+DICTIONARY_COLUMNS = ("mode", "meta")
+JSON_COLUMNS = ("id", "meta", "source_id")
+BATCH_ROWS = 65536
+COMPRESSION = "zstd"
+
+
+def _pyarrow() -> Any:
+    try:
+        import pyarrow
+        import pyarrow.ipc  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError as exc:
+        raise SystemExit("Columnar formats need pyarrow: pip install pyarrow") from exc
+    return pyarrow
+
+
+def detect_format(path: Path) -> str | None:
+    """Return "parquet"/"arrow" for columnar files, None for JSONL."""
+    return COLUMNAR_SUFFIXES.get(path.suffix.lower())
+
+
+def _schema(pa: Any) -> Any:
+    return pa.schema(
+        [
+            pa.field(name, pa.dictionary(pa.int32(), pa.string()) if name in DICTIONARY_COLUMNS else pa.string())
+            for name in COLUMNS
+        ]
+    )
+
+
+class ColumnarWriter:
+    """Buffer distilled items and flush them as compressed record batches.
+
+    Arrow output uses the IPC stream format so each batch may carry its own
+    dictionaries.
+    """
+
+    def __init__(self, path: Path, fmt: str, batch_rows: int = BATCH_ROWS) -> None:
+        if fmt not in COLUMNAR_FORMATS:
+            raise ValueError(f"unknown columnar format: {fmt}")
+        self.pa = _pyarrow()
+        self.path = path
+        self.fmt = fmt
+        self.batch_rows = batch_rows
+        self.schema = _schema(self.pa)
+        self._columns: dict[str, list[str | None]] = {name: [] for name in COLUMNS}
+        if fmt == "parquet":
+            self._writer = self.pa.parquet.ParquetWriter(str(path), self.schema, compression=COMPRESSION)
+        else:
+            self._sink = self.pa.OSFile(str(path), "wb")
+            options = self.pa.ipc.IpcWriteOptions(compression=COMPRESSION)
+            self._writer = self.pa.ipc.new_stream(self._sink, self.schema, options=options)
+
+    def write(self, item: dict) -> None:
+        for name in COLUMNS:
+            value = item.get(name)
+            if name == "meta":
+                value = json.dumps(value if value is not None else {}, ensure_ascii=False, sort_keys=True)
+            elif name in JSON_COLUMNS:
+                value = None if value is None else json.dumps(value, ensure_ascii=False)
+            elif value is not None:
+                value = str(value)
+            self._columns[name].append(value)
+        if len(self._columns["prompt"]) >= self.batch_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._columns["prompt"]:
+            return
+        pa = self.pa
+        arrays = []
+        for name in COLUMNS:
+            array = pa.array(self._columns[name], type=pa.string())
+            arrays.append(array.dictionary_encode() if name in DICTIONARY_COLUMNS else array)
+        batch = pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+        if self.fmt == "parquet":
+            self._writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            self._writer.write_batch(batch)
+        self._columns = {name: [] for name in COLUMNS}
+
+    def close(self) -> None:
+        self.flush()
+        self._writer.close()
+        if self.fmt == "arrow":
+            self._sink.close()
+
+    def __enter__(self) -> "ColumnarWriter":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+
+class ColumnarDataset:
+    """Iterable over a Parquet/Arrow dataset that reads only the projected columns."""
+
+    def __init__(self, path: Path, columns: list[str] | None = None) -> None:
+        self.pa = _pyarrow()
+        self.path = path
+        self.fmt = detect_format(path)
+        if self.fmt is None:
+            raise ValueError(f"not a columnar dataset: {path}")
+        self.columns = list(columns) if columns else list(COLUMNS)
+        self._num_rows: int | None = None
+
+    def iter_batches(self) -> Iterator[Any]:
+        if self.fmt == "parquet":
+            yield from self.pa.parquet.ParquetFile(str(self.path)).iter_batches(
+                batch_size=BATCH_ROWS, columns=self.columns
+            )
+            return
+        with self.pa.memory_map(str(self.path), "r") as source:
+            yield from self.pa.ipc.open_stream(source)
+
+    def __iter__(self) -> Iterator[dict]:
+        decode = [name for name in self.columns if name in JSON_COLUMNS]
+        for batch in self.iter_batches():
+            columns = {name: batch.column(batch.schema.get_field_index(name)).to_pylist() for name in self.columns}
+            for values in zip(*(columns[name] for name in self.columns)):
+                row = dict(zip(self.columns, values))
+                for name in decode:
+                    if row[name] is not None:
+                        row[name] = json.loads(row[name])
+                yield row
+
+    def __len__(self) -> int:
+        if self._num_rows is None:
+            if self.fmt == "parquet":
+                self._num_rows = self.pa.parquet.ParquetFile(str(self.path)).metadata.num_rows
+            else:
+                self._num_rows = sum(batch.num_rows for batch in self.iter_batches())
+        return self._num_rows
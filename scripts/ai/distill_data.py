@@ -2,23 +2,195 @@
 from __future__ import annotations
 
 import argparse
+import hashlib
 import json
+import random
+import re
+import sqlite3
+import tempfile
+import zlib
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Iterable
+from typing import Iterator
 
+import numpy as np
+
+from columnar_io import COLUMNAR_FORMATS, ColumnarWriter
+from jsonl_io import JsonlWriter, iter_jsonl
+
+
+DIGEST_SIZE = 16
+
+
+class DedupIndex:
+    """Set of fixed-width (prompt, response) digests, optionally persisted in SQLite.
+
+    With a backing path the index survives across runs, so incremental
+    distillation skips records that were already emitted into an earlier output.
+    A run's new digests stay in one open transaction and are committed only by
+    ``close()`` after the output has been written; a failed run rolls them back,
+    so a rerun with the same index re-emits those records. Only records that
+    were actually written are added; records dropped by a later filter (e.g.
+    near-duplicate removal) stay eligible for future runs.
+    """
+
+    def __init__(self, path: Path | None = None) -> None:
+        self.path = path
+        self._digests: set[bytes] = set()
+        self._conn: sqlite3.Connection | None = None
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(path))
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS digests (digest BLOB PRIMARY KEY) WITHOUT ROWID")
+            self._conn.execute("CREATE TEMP TABLE run_digests (digest BLOB PRIMARY KEY) WITHOUT ROWID")
+            self._conn.commit()
+
+    @staticmethod
+    def digest(prompt: str, response: str) -> bytes:
+        prompt_bytes = prompt.encode("utf-8")
+        hasher = hashlib.blake2b(digest_size=DIGEST_SIZE)
+        hasher.update(len(prompt_bytes).to_bytes(8, "little"))
+        hasher.update(prompt_bytes)
+        hasher.update(response.encode("utf-8"))
+        return hasher.digest()
+
+    def check(self, key: bytes) -> str | None:
+        """Return None if the digest is new, else the drop reason; nothing is recorded.
+
+        ``duplicate`` means the pair was already emitted in this run,
+        ``incremental_skipped`` that an earlier run already emitted it.
+        """
+        if self._conn is None:
+            return "duplicate" if key in self._digests else None
+        if self._conn.execute("SELECT 1 FROM run_digests WHERE digest = ?", (key,)).fetchone():
+            return "duplicate"
+        if self._conn.execute("SELECT 1 FROM digests WHERE digest = ?", (key,)).fetchone():
+            return "incremental_skipped"
+        return None
+
+    def add(self, key: bytes) -> None:
+        """Record a digest once its record has been written to the output."""
+        if self._conn is None:
+            self._digests.add(key)
+            return
+        self._conn.execute("INSERT INTO run_digests (digest) VALUES (?)", (key,))
+        self._conn.execute("INSERT OR IGNORE INTO digests (digest) VALUES (?)", (key,))
+
+    def __len__(self) -> int:
+        if self._conn is None:
+            return len(self._digests)
+        return self._conn.execute("SELECT COUNT(*) FROM digests").fetchone()[0]
+
+    def close(self, commit: bool = True) -> None:
+        """Commit this run's digests (or roll them back) and close the index."""
+        if self._conn is not None:
+            if commit:
+                self._conn.commit()
+            else:
+                self._conn.rollback()
+            self._conn.close()
+            self._conn = None
 
-def iter_jsonl(paths: Iterable[Path]) -> Iterable[dict]:
-    for path in paths:
-        with path.open("r", encoding="utf-8") as handle:
-            for line_num, line in enumerate(handle, start=1):
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    yield json.loads(line)
-                except json.JSONDecodeError as exc:
-                    raise ValueError(f"Invalid JSON in {path}:{line_num}") from exc
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+DIGIT_PATTERN = re.compile(r"\d+")
+SPACE_PATTERN = re.compile(r"\s+")
+PRIME = np.uint64(MERSENNE_PRIME)
+HASH_MASK = np.uint64(MAX_HASH)
+LOW_29 = np.uint64((1 << 29) - 1)
+SHIFT_29, SHIFT_32, SHIFT_61 = np.uint64(29), np.uint64(32), np.uint64(61)
+
+
+def choose_bands(num_perm: int, threshold: float) -> tuple[int, int]:
+    """Pick (bands, rows) whose LSH S-curve midpoint (1/b)^(1/r) is closest to threshold."""
+    best = (num_perm, 1)
+    best_gap = float("inf")
+    for bands in range(1, num_perm + 1):
+        if num_perm % bands:
+            continue
+        rows = num_perm // bands
+        gap = abs((1 / bands) ** (1 / rows) - threshold)
+        if gap < best_gap:
+            best, best_gap = (bands, rows), gap
+    return best
+
+
+class NearDupIndex:
+    """MinHash + LSH banding index for near-duplicate detection.
+
+    Text is normalized (case, whitespace, digit runs) and split into character
+    shingles, so templated records that only differ in numbers or short names
+    collide in at least one band. Each record is checked against the band
+    buckets in O(num_perm) time; only band keys are kept, never signatures or
+    texts. Signatures are computed as one permutation x shingle matrix in
+    NumPy, with the mod 2^61 - 1 product split into 32-bit halves so it stays
+    exact in uint64. Band collisions are treated as near-duplicates of the first record
+    that claimed the bucket (its cluster).
+    """
+
+    def __init__(self, threshold: float, num_perm: int = 128, shingle_size: int = 5, seed: int = 1) -> None:
+        if not 0.0 < threshold <= 1.0:
+            raise ValueError(f"near-dup threshold must be in (0, 1], got {threshold}")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = choose_bands(num_perm, threshold)
+        rng = random.Random(seed)
+        perms = [(rng.randint(1, MERSENNE_PRIME - 1), rng.randint(0, MERSENNE_PRIME - 1)) for _ in range(num_perm)]
+        a = np.array([a for a, _ in perms], dtype=np.uint64)[:, None]
+        self._a_hi = a >> SHIFT_32
+        self._a_lo = a & HASH_MASK
+        self._b = np.array([b for _, b in perms], dtype=np.uint64)[:, None]
+        self._buckets: list[dict[int, int]] = [{} for _ in range(self.bands)]
+        self._size = 0
+        self.clusters: set[int] = set()
+
+    def normalize(self, text: str) -> str:
+        text = DIGIT_PATTERN.sub("0", text.lower())
+        return SPACE_PATTERN.sub("", text)
+
+    def signature(self, text: str) -> np.ndarray:
+        """Per permutation, min over shingles of ((a * x + b) mod 2^61 - 1) & MAX_HASH."""
+        text = self.normalize(text)
+        size = self.shingle_size
+        shingles = {zlib.crc32(text[i : i + size].encode("utf-8")) for i in range(max(len(text) - size + 1, 1))}
+        x = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+        # a * x = a_hi * x * 2^32 + a_lo * x; with 2^61 = 1 (mod p) every term fits in uint64.
+        hi = np.multiply(self._a_hi, x)
+        v = hi >> SHIFT_29
+        hi &= LOW_29
+        hi <<= SHIFT_32
+        v += hi
+        lo = np.multiply(self._a_lo, x, out=hi)
+        v += lo >> SHIFT_61
+        lo &= PRIME
+        v += lo
+        v += self._b
+        lo = v >> SHIFT_61
+        v &= PRIME
+        v += lo
+        # v < 2p here; v - p wraps around unless v >= p, so the minimum is v mod p.
+        np.minimum(v, v - PRIME, out=v)
+        v &= HASH_MASK
+        return v.min(axis=1)
+
+    def add(self, text: str) -> int | None:
+        """Insert text and return None, or return the cluster id it near-duplicates."""
+        sig = self.signature(text)
+        keys = [hash(sig[band * self.rows : (band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+        for bucket, key in zip(self._buckets, keys):
+            cluster = bucket.get(key)
+            if cluster is not None:
+                self.clusters.add(cluster)
+                return cluster
+        record_id = self._size
+        self._size += 1
+        for bucket, key in zip(self._buckets, keys):
+            bucket[key] = record_id
+        return None
 
 
 def build_prompt(messages: list[dict]) -> tuple[str | None, str | None]:
@@ -41,6 +213,66 @@ def build_prompt(messages: list[dict]) -> tuple[str | None, str | None]:
     return prompt, assistant_text
 
 
+def distill_record(record: dict) -> tuple[dict | None, str | None]:
+    """Convert one chat-style record, returning (item, None) or (None, drop_reason)."""
+    messages = record.get("messages")
+    if not isinstance(messages, list):
+        return None, "missing_messages"
+    prompt, response = build_prompt(messages)
+    if not prompt or not response:
+        return None, "missing_prompt_or_response"
+    return (
+        {
+            "id": record.get("id"),
+            "mode": record.get("mode"),
+            "prompt": prompt,
+            "response": response,
+            "meta": record.get("meta", {}),
+            "source_id": record.get("id"),
+        },
+        None,
+    )
+
+
+def distill_shard(task: tuple[Path, Path]) -> Counter:
+    """Worker: distill one input file into a shard file and return its drop counts."""
+    input_path, shard_path = task
+    dropped = Counter()
+    with shard_path.open("w", encoding="utf-8") as handle:
+        for record in iter_jsonl([input_path]):
+            item, reason = distill_record(record)
+            if item is None:
+                dropped[reason] += 1
+                continue
+            handle.write(json.dumps(item, ensure_ascii=False) + "\n")
+    return dropped
+
+
+def iter_distilled(input_paths: list[Path], dropped: Counter, workers: int = 1) -> Iterator[dict]:
+    """Yield distilled items in input order, counting per-record drops into `dropped`.
+
+    With workers > 1 each input file is distilled in a process pool into a
+    temporary shard; shards are merged back strictly in input order, so the
+    caller sees the same item sequence as the serial path.
+    """
+    if workers <= 1 or len(input_paths) <= 1:
+        for record in iter_jsonl(input_paths):
+            item, reason = distill_record(record)
+            if item is None:
+                dropped[reason] += 1
+                continue
+            yield item
+        return
+
+    with tempfile.TemporaryDirectory(prefix="distill_shards_") as tmp_dir:
+        tasks = [(path, Path(tmp_dir) / f"shard_{i:05d}.jsonl") for i, path in enumerate(input_paths)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for (_, shard_path), shard_dropped in zip(tasks, pool.map(distill_shard, tasks)):
+                dropped.update(shard_dropped)
+                yield from iter_jsonl(shard_path)
+                shard_path.unlink()
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(description="Distill training data into prompt/response format.")
     parser.add_argument(
@@ -49,8 +281,33 @@ def main() -> None:
         nargs="+",
         help="Input JSONL file(s) or directories containing JSONL files.",
     )
-    parser.add_argument("--output", required=True, help="Output distilled JSONL file.")
+    parser.add_argument("--output", required=True, help="Output distilled file.")
+    parser.add_argument(
+        "--output-format",
+        choices=("jsonl",) + COLUMNAR_FORMATS,
+        default="jsonl",
+        help="jsonl (default), or columnar parquet/arrow with dictionary-encoded mode/meta and zstd compression.",
+    )
     parser.add_argument("--report", default="outputs/distillation_report.json", help="Report JSON path.")
+    parser.add_argument(
+        "--dedup-index",
+        default=None,
+        help="Optional SQLite file backing the dedup index; reuse it across runs for incremental distillation.",
+    )
+    parser.add_argument(
+        "--near-dup-threshold",
+        type=float,
+        default=None,
+        help="Enable MinHash/LSH near-duplicate removal at this estimated Jaccard similarity (e.g. 0.8).",
+    )
+    parser.add_argument("--minhash-perm", type=int, default=128, help="Number of MinHash permutations.")
+    parser.add_argument("--shingle-size", type=int, default=5, help="Character shingle size for MinHash.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Distill input files in a process pool; output order stays identical to a serial run.",
+    )
     args = parser.parse_args()
 
     input_paths: list[Path] = []
@@ -69,46 +326,67 @@ def main() -> None:
     report_path = Path(args.report)
     report_path.parent.mkdir(parents=True, exist_ok=True)
 
+    if output_path.resolve() in {path.resolve() for path in input_paths}:
+        raise SystemExit(f"Output file must not be one of the inputs: {output_path}")
+
+    # Records are written as soon as they are accepted and the report is built
+    # from running counters, so memory does not grow with the corpus size.
     dropped = Counter()
-    seen = set()
-    distilled = []
+    seen = DedupIndex(Path(args.dedup_index) if args.dedup_index else None)
+    near_dup = (
+        NearDupIndex(args.near_dup_threshold, num_perm=args.minhash_perm, shingle_size=args.shingle_size)
+        if args.near_dup_threshold is not None
+        else None
+    )
+    distilled_count = 0
 
-    for record in iter_jsonl(input_paths):
-        messages = record.get("messages")
-        if not isinstance(messages, list):
-            dropped["missing_messages"] += 1
-            continue
-        prompt, response = build_prompt(messages)
-        if not prompt or not response:
-            dropped["missing_prompt_or_response"] += 1
-            continue
-        key = (prompt, response)
-        if key in seen:
-            dropped["duplicate"] += 1
-            continue
-        seen.add(key)
-        distilled.append(
-            {
-                "id": record.get("id"),
-                "mode": record.get("mode"),
-                "prompt": prompt,
-                "response": response,
-                "meta": record.get("meta", {}),
-                "source_id": record.get("id"),
-            }
-        )
-
-    with output_path.open("w", encoding="utf-8") as handle:
-        for item in distilled:
-            handle.write(json.dumps(item, ensure_ascii=False) + "\n")
+    try:
+        if args.output_format == "jsonl":
+            writer = JsonlWriter(output_path)
+        else:
+            writer = ColumnarWriter(output_path, args.output_format)
+        with writer:
+            for item in iter_distilled(input_paths, dropped, workers=args.workers):
+                key = seen.digest(item["prompt"], item["response"])
+                reason = seen.check(key)
+                if reason is not None:
+                    dropped[reason] += 1
+                    continue
+                if near_dup is not None and near_dup.add(f"{item['prompt']}\n{item['response']}") is not None:
+                    dropped["near_duplicate"] += 1
+                    continue
+                writer.write(item)
+                seen.add(key)
+                distilled_count += 1
+        dedup_index_size = len(seen)
+    except BaseException:
+        seen.close(commit=False)
+        raise
+    seen.close()
 
+    # Records an earlier run already emitted are not drops of this corpus; keep them apart from duplicates.
+    incremental_skipped = dropped.pop("incremental_skipped", 0)
     report = {
         "inputs": [str(path) for path in input_paths],
         "output": str(output_path),
-        "total_records": sum(dropped.values()) + len(distilled),
-        "distilled_records": len(distilled),
+        "output_format": args.output_format,
+        "total_records": sum(dropped.values()) + incremental_skipped + distilled_count,
+        "distilled_records": distilled_count,
+        "incremental_skipped": incremental_skipped,
         "dropped": dict(dropped),
+        "dedup_index": args.dedup_index,
+        "dedup_index_size": dedup_index_size,
+        "workers": args.workers,
     }
+    if near_dup is not None:
+        report["near_dup"] = {
+            "threshold": near_dup.threshold,
+            "num_perm": near_dup.num_perm,
+            "bands": near_dup.bands,
+            "rows": near_dup.rows,
+            "shingle_size": near_dup.shingle_size,
+            "clusters": len(near_dup.clusters),
+        }
     report_path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
 
 
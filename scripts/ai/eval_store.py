@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""Indexed SQLite store of eval-report results across training runs.
+
+Each ``eval_report_<lane>.json`` is parsed once per (run, lane) and re-read
+only when its size or mtime changes. Per-sample outcomes and failure buckets
+are kept in indexed tables, so bucket listings, per-lane rates and cross-run
+diffs ("newly failing since run X") are SQL queries instead of rescans of
+every report's ``details`` array.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+from jsonl_io import loads
+
+BUCKETS = ("key_points_miss", "template_format_fail", "refusal_mismatch")
+REPORT_PREFIX = "eval_report_"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    run_id TEXT NOT NULL,
+    lane TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sample_count INTEGER NOT NULL,
+    ingested_at TEXT NOT NULL,
+    PRIMARY KEY (run_id, lane)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS samples (
+    run_id TEXT NOT NULL,
+    lane TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    sample_id TEXT NOT NULL,
+    type TEXT,
+    failed INTEGER NOT NULL,
+    PRIMARY KEY (run_id, lane, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS failures (
+    run_id TEXT NOT NULL,
+    lane TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    sample_id TEXT NOT NULL,
+    PRIMARY KEY (run_id, lane, bucket, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS samples_by_id ON samples (sample_id, lane, run_id);
+CREATE INDEX IF NOT EXISTS failures_by_sample ON failures (run_id, lane, sample_id, bucket);
+CREATE INDEX IF NOT EXISTS failures_by_bucket ON failures (bucket, lane, run_id);
+"""
+
+
+def classify(result: dict[str, Any]) -> list[str]:
+    """Failure buckets for one eval ``result`` entry."""
+    buckets = []
+    if result.get("key_points_total", 0) > 0 and result.get("key_points_hit", 0) < result.get("key_points_total", 0):
+        buckets.append("key_points_miss")
+    if not bool(result.get("response_format", False)):
+        buckets.append("template_format_fail")
+    if (
+        result.get("refused_pred") is not None
+        and result.get("refused_expected") is not None
+        and result.get("refused_pred") != result.get("refused_expected")
+    ):
+        buckets.append("refusal_mismatch")
+    return buckets
+
+
+def lane_of(report_path: Path) -> str:
+    """``eval_report_all.json`` -> ``all``."""
+    stem = report_path.stem
+    return stem[len(REPORT_PREFIX) :] if stem.startswith(REPORT_PREFIX) else stem
+
+
+class EvalStore:
+    """SQLite-backed eval results, keyed by (run_id, lane)."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path))
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def ingest(self, run_id: str, report_path: Path, lane: str | None = None) -> bool:
+        """Load one eval report unless the stored copy is current; returns True if (re)ingested."""
+        lane = lane or lane_of(report_path)
+        stat = report_path.stat()
+        row = self._conn.execute(
+            "SELECT size, mtime_ns FROM reports WHERE run_id = ? AND lane = ?", (run_id, lane)
+        ).fetchone()
+        if row == (stat.st_size, stat.st_mtime_ns):
+            return False
+
+        details = loads(report_path.read_bytes()).get("details", [])
+        samples, failures = [], []
+        for seq, d in enumerate(details):
+            sid = d.get("id", "unknown")
+            buckets = classify(d.get("result", {}))
+            samples.append((run_id, lane, seq, sid, d.get("type"), int(bool(buckets))))
+            failures.extend((run_id, lane, bucket, seq, sid) for bucket in buckets)
+
+        with self._conn:
+            for table in ("reports", "samples", "failures"):
+                self._conn.execute(f"DELETE FROM {table} WHERE run_id = ? AND lane = ?", (run_id, lane))
+            self._conn.executemany("INSERT INTO samples VALUES (?, ?, ?, ?, ?, ?)", samples)
+            self._conn.executemany("INSERT INTO failures VALUES (?, ?, ?, ?, ?)", failures)
+            self._conn.execute(
+                "INSERT INTO reports VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    run_id,
+                    lane,
+                    str(report_path),
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                    len(samples),
+                    datetime.utcnow().isoformat() + "Z",
+                ),
+            )
+        return True
+
+    def ingest_run(self, run_dir: Path, run_id: str | None = None) -> dict[str, bool]:
+        """Ingest every ``eval_report_<lane>.json`` in a run directory."""
+        if not run_dir.is_dir():
+            raise FileNotFoundError(f"Eval run directory not found: {run_dir}")
+        run_id = run_id or run_dir.name
+        return {
+            lane_of(path): self.ingest(run_id, path)
+            for path in sorted(run_dir.glob(f"{REPORT_PREFIX}*.json"))
+        }
+
+    def has_report(self, run_id: str, lane: str) -> bool:
+        row = self._conn.execute("SELECT 1 FROM reports WHERE run_id = ? AND lane = ?", (run_id, lane)).fetchone()
+        return row is not None
+
+    def runs(self) -> list[str]:
+        return [r[0] for r in self._conn.execute("SELECT DISTINCT run_id FROM reports ORDER BY run_id")]
+
+    def bucket_ids(self, run_id: str, lane: str, bucket: str) -> list[str]:
+        """Sample ids in one failure bucket, in report order."""
+        rows = self._conn.execute(
+            "SELECT sample_id FROM failures WHERE run_id = ? AND lane = ? AND bucket = ? ORDER BY seq",
+            (run_id, lane, bucket),
+        )
+        return [r[0] for r in rows]
+
+    def failed_ids(self, run_id: str, lane: str) -> list[str]:
+        rows = self._conn.execute(
+            "SELECT DISTINCT sample_id FROM failures WHERE run_id = ? AND lane = ? ORDER BY sample_id",
+            (run_id, lane),
+        )
+        return [r[0] for r in rows]
+
+    def newly_failing(self, run_id: str, since_run: str, lane: str, bucket: str | None = None) -> list[str]:
+        """Samples failing in run_id (optionally in one bucket) that did not fail that way in since_run."""
+        bucket_filter = "AND f.bucket = ?" if bucket else ""
+        prior_bucket = "AND g.bucket = f.bucket" if bucket else ""
+        params: list[Any] = [run_id, lane] + ([bucket] if bucket else []) + [since_run]
+        rows = self._conn.execute(
+            f"""
+            SELECT DISTINCT f.sample_id FROM failures f
+            WHERE f.run_id = ? AND f.lane = ? {bucket_filter}
+              AND NOT EXISTS (
+                SELECT 1 FROM failures g
+                WHERE g.run_id = ? AND g.lane = f.lane AND g.sample_id = f.sample_id {prior_bucket}
+              )
+            ORDER BY f.sample_id
+            """,
+            params,
+        )
+        return [r[0] for r in rows]
+
+    def fixed(self, run_id: str, since_run: str, lane: str) -> list[str]:
+        """Samples that failed in since_run and were evaluated in run_id without failing.
+
+        Samples missing from run_id are not counted as fixed.
+        """
+        rows = self._conn.execute(
+            """
+            SELECT DISTINCT g.sample_id FROM failures g
+            WHERE g.run_id = ? AND g.lane = ?
+              AND EXISTS (
+                SELECT 1 FROM samples s
+                WHERE s.sample_id = g.sample_id AND s.lane = g.lane AND s.run_id = ?
+              )
+              AND NOT EXISTS (
+                SELECT 1 FROM failures f
+                WHERE f.run_id = ? AND f.lane = g.lane AND f.sample_id = g.sample_id
+              )
+            ORDER BY g.sample_id
+            """,
+            (since_run, lane, run_id, run_id),
+        )
+        return [r[0] for r in rows]
+
+    def diff(self, run_id: str, since_run: str, lane: str) -> dict[str, Any]:
+        """Newly failing / fixed samples between two runs, overall and per bucket."""
+        return {
+            "run_id": run_id,
+            "since_run": since_run,
+            "lane": lane,
+            "newly_failing": self.newly_failing(run_id, since_run, lane),
+            "fixed": self.fixed(run_id, since_run, lane),
+            "newly_failing_by_bucket": {
+                bucket: self.newly_failing(run_id, since_run, lane, bucket) for bucket in BUCKETS
+            },
+        }
+
+    def lane_rates(self, run_id: str | None = None) -> list[dict[str, Any]]:
+        """Per (run, lane) sample counts, overall failure rate and per-bucket rates."""
+        run_filter = "WHERE r.run_id = ?" if run_id else ""
+        params = [run_id] if run_id else []
+        counts: dict[tuple[str, str], dict[str, int]] = {}
+        for run, lane, bucket, n in self._conn.execute(
+            f"""
+            SELECT r.run_id, r.lane, f.bucket, COUNT(*) FROM reports r
+            JOIN failures f ON f.run_id = r.run_id AND f.lane = r.lane
+            {run_filter}
+            GROUP BY r.run_id, r.lane, f.bucket
+            """,
+            params,
+        ):
+            counts.setdefault((run, lane), {})[bucket] = n
+
+        out = []
+        for run, lane, total, failed in self._conn.execute(
+            f"""
+            SELECT r.run_id, r.lane, r.sample_count, COALESCE(SUM(s.failed), 0) FROM reports r
+            LEFT JOIN samples s ON s.run_id = r.run_id AND s.lane = r.lane
+            {run_filter}
+            GROUP BY r.run_id, r.lane
+            ORDER BY r.run_id, r.lane
+            """,
+            params,
+        ):
+            by_bucket = counts.get((run, lane), {})
+            out.append(
+                {
+                    "run_id": run,
+                    "lane": lane,
+                    "total": total,
+                    "failed": failed,
+                    "fail_rate": 0.0 if total == 0 else failed / total,
+                    "bucket_rates": {b: 0.0 if total == 0 else by_bucket.get(b, 0) / total for b in BUCKETS},
+                }
+            )
+        return out
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> "EvalStore":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Query eval results across training runs.")
+    parser.add_argument("--db", type=Path, required=True, help="SQLite eval results store")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_ingest = sub.add_parser("ingest", help="Ingest the eval_report_<lane>.json files of run directories")
+    p_ingest.add_argument("run_dirs", nargs="+", type=Path)
+
+    p_rates = sub.add_parser("rates", help="Per-lane failure rates")
+    p_rates.add_argument("--run-id", default=None)
+
+    p_failures = sub.add_parser("failures", help="Sample ids in one failure bucket")
+    p_failures.add_argument("--run-id", required=True)
+    p_failures.add_argument("--lane", default="all")
+    p_failures.add_argument("--bucket", choices=BUCKETS, required=True)
+
+    p_diff = sub.add_parser("diff", help="Samples newly failing (and fixed) since another run")
+    p_diff.add_argument("--run-id", required=True)
+    p_diff.add_argument("--since", required=True)
+    p_diff.add_argument("--lane", default="all")
+
+    args = parser.parse_args()
+    with EvalStore(args.db) as store:
+        if args.command == "ingest":
+            result: Any = {str(run_dir): store.ingest_run(run_dir) for run_dir in args.run_dirs}
+        elif args.command == "rates":
+            result = store.lane_rates(args.run_id)
+        elif args.command == "failures":
+            result = store.bucket_ids(args.run_id, args.lane, args.bucket)
+        else:
+            result = store.diff(args.run_id, args.since, args.lane)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""Shared JSONL I/O helpers for the training data scripts.
+
+Files are read as raw bytes in large chunks and each line is decoded with the
+fastest JSON backend available (orjson, then msgspec, then the stdlib).
+``JsonlDataset`` adds memory-mapped random access for eval-style sampling.
+"""
+
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import random
+import struct
+from array import array
+from collections import deque
+from collections.abc import Sequence
+from concurrent.futures import Executor
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+if orjson is not None:
+    BACKEND = "orjson"
+    loads: Callable[[bytes], Any] = orjson.loads
+    DECODE_ERRORS: tuple[type[Exception], ...] = (orjson.JSONDecodeError, UnicodeDecodeError)
+elif msgspec is not None:
+    BACKEND = "msgspec"
+    loads = msgspec.json.decode
+    DECODE_ERRORS = (msgspec.DecodeError, UnicodeDecodeError)
+else:
+    BACKEND = "json"
+    loads = json.loads
+    DECODE_ERRORS = (json.JSONDecodeError, UnicodeDecodeError)
+
+
+def iter_lines(
+    path: Path, chunk_size: int = CHUNK_SIZE, start: int = 0, end: int | None = None, first_line: int = 1
+) -> Iterator[tuple[int, bytes]]:
+    """Yield (line_num, stripped raw line) for every line, blank lines included.
+
+    ``start``/``end``/``first_line`` restrict the scan to one range from
+    byte_ranges() while keeping whole-file line numbers.
+    """
+    line_num = first_line - 1
+    tail = b""
+    remaining = None if end is None else end - start
+    with path.open("rb") as handle:
+        handle.seek(start)
+        while remaining is None or remaining > 0:
+            chunk = handle.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            lines = (tail + chunk).split(b"\n")
+            tail = lines.pop()
+            for line in lines:
+                line_num += 1
+                yield line_num, line.strip()
+    if tail:
+        yield line_num + 1, tail.strip()
+
+
+def iter_jsonl(paths: Path | Iterable[Path]) -> Iterator[dict]:
+    """Yield decoded records from one or more JSONL files, skipping blank lines."""
+    if isinstance(paths, Path):
+        paths = [paths]
+    for path in paths:
+        for line_num, line in iter_lines(path):
+            if not line:
+                continue
+            try:
+                yield loads(line)
+            except DECODE_ERRORS as exc:
+                raise ValueError(f"Invalid JSON in {path}:{line_num}") from exc
+
+
+def byte_ranges(path: Path, chunk_bytes: int) -> list[tuple[int, int, int]]:
+    """Split a file into newline-aligned (start, end, first_line) ranges for range workers.
+
+    Adjacent ranges cover every line exactly once, and ``first_line`` is the
+    1-based number of each range's first line, so workers streaming disjoint
+    parts of one file report the same line numbers as a serial scan.
+    """
+    ranges: list[tuple[int, int, int]] = []
+    size = path.stat().st_size
+    if size == 0:
+        return ranges
+    with path.open("rb") as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start, first_line = 0, 1
+        while start < size:
+            end = min(start + chunk_bytes, size)
+            if end < size:
+                newline = mm.find(b"\n", max(end - 1, start))
+                end = size if newline < 0 else newline + 1
+            ranges.append((start, end, first_line))
+            first_line += mm[start:end].count(b"\n")
+            start = end
+    return ranges
+
+
+def iter_jsonl_range(path: Path, start: int, end: int, first_line: int = 1) -> Iterator[dict]:
+    """Yield the records of one byte_ranges() range, skipping blank lines."""
+    for line_num, line in iter_lines(path, start=start, end=end, first_line=first_line):
+        if not line:
+            continue
+        try:
+            yield loads(line)
+        except DECODE_ERRORS as exc:
+            raise ValueError(f"Invalid JSON in {path}:{line_num}") from exc
+
+
+def imap_bounded(pool: Executor, fn: Callable[[Any], Any], tasks: Iterable[Any], window: int) -> Iterator[Any]:
+    """Like pool.map, but with at most ``window`` tasks in flight.
+
+    Results are yielded in task order and each future is dropped once its
+    result is handed out, so only ``window`` range outputs are held at a time.
+    """
+    tasks = iter(tasks)
+    in_flight: deque[Any] = deque(pool.submit(fn, task) for task in islice(tasks, window))
+    while in_flight:
+        result = in_flight.popleft().result()
+        for task in islice(tasks, 1):
+            in_flight.append(pool.submit(fn, task))
+        yield result
+
+
+class JsonlWriter:
+    """Write one JSON object per line (stdlib encoder, non-ASCII kept as-is)."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._handle = path.open("w", encoding="utf-8")
+
+    def write(self, row: dict) -> None:
+        self._handle.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    def close(self) -> None:
+        self._handle.close()
+
+    def __enter__(self) -> "JsonlWriter":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+
+INDEX_MAGIC = b"JSONLIX1"
+INDEX_HEADER = struct.Struct("<8sQqQ")
+
+
+class JsonlDataset(Sequence):
+    """Random-access, memory-mapped view over a JSONL file.
+
+    A sidecar ``<file>.idx`` holding the byte offset and line number of every
+    non-blank line is built on first use and reused while the source file's
+    size and mtime are unchanged. Rows are decoded only when accessed, so
+    ``len()``, indexing, slicing and ``sample(k)`` never load the whole file.
+    """
+
+    def __init__(self, path: Path, index_path: Path | None = None) -> None:
+        self.path = Path(path)
+        self.index_path = index_path or self.path.with_name(self.path.name + ".idx")
+        stat = self.path.stat()
+        self._handle = self.path.open("rb")
+        self._mm = mmap.mmap(self._handle.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else b""
+        self._offsets, self._line_nums = self._load_index(stat)
+
+    def _load_index(self, stat: os.stat_result) -> tuple[array, array]:
+        offsets, line_nums = array("Q"), array("Q")
+        try:
+            with self.index_path.open("rb") as handle:
+                magic, size, mtime_ns, count = INDEX_HEADER.unpack(handle.read(INDEX_HEADER.size))
+                if magic == INDEX_MAGIC and size == stat.st_size and mtime_ns == stat.st_mtime_ns:
+                    offsets.fromfile(handle, count)
+                    line_nums.fromfile(handle, count)
+                    return offsets, line_nums
+        except (OSError, EOFError, struct.error):
+            pass
+
+        offsets, line_nums = array("Q"), array("Q")
+        mm, pos, line_num = self._mm, 0, 0
+        while pos < len(mm):
+            end = mm.find(b"\n", pos)
+            if end < 0:
+                end = len(mm)
+            line_num += 1
+            if mm[pos:end].strip():
+                offsets.append(pos)
+                line_nums.append(line_num)
+            pos = end + 1
+
+        try:
+            with self.index_path.open("wb") as handle:
+                handle.write(INDEX_HEADER.pack(INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, len(offsets)))
+                offsets.tofile(handle)
+                line_nums.tofile(handle)
+        except OSError:
+            pass  # Read-only location: keep the index in memory only.
+        return offsets, line_nums
+
+    def _decode(self, i: int) -> dict:
+        start = self._offsets[i]
+        end = self._mm.find(b"\n", start)
+        line = self._mm[start : end if end >= 0 else len(self._mm)]
+        try:
+            return loads(line.strip())
+        except DECODE_ERRORS as exc:
+            raise ValueError(f"Invalid JSON in {self.path}:{self._line_nums[i]}") from exc
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __getitem__(self, key: int | slice) -> Any:
+        if isinstance(key, slice):
+            return [self._decode(i) for i in range(*key.indices(len(self)))]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError(f"row {key} out of range for {self.path} ({len(self)} rows)")
+        return self._decode(key)
+
+    def __iter__(self) -> Iterator[dict]:
+        for i in range(len(self)):
+            yield self._decode(i)
+
+    def sample(self, k: int, seed: int | None = None) -> list[dict]:
+        """Return min(k, len) distinct rows chosen uniformly at random, in O(k)."""
+        picks = random.Random(seed).sample(range(len(self)), min(k, len(self)))
+        return [self._decode(i) for i in picks]
+
+    def take(self, k: int, seed: int | None = None) -> list[dict]:
+        """Return the first k rows, or k random rows when a seed is given."""
+        return self[:k] if seed is None else self.sample(k, seed=seed)
+
+    def close(self) -> None:
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._handle.close()
+
+    def __enter__(self) -> "JsonlDataset":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
@@ -0,0 +1,122 @@
+"""Streaming schema/template validator for chat-style SFT samples.
+
+Each lane declares its required top-level fields, required ``meta`` keys and
+the Markdown headings its assistant answer must contain. Headings are matched
+with one precompiled alternation regex, so each answer is scanned once.
+Validators accumulate state row by row and can be merged, which lets a JSONL
+file be validated in byte-range chunks across a process pool.
+"""
+
+from __future__ import annotations
+
+import re
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Iterable
+
+from jsonl_io import byte_ranges, iter_jsonl, iter_jsonl_range
+
+REQUIRED_TOP = ("id", "mode", "messages", "meta")
+EXPECTED_ROLES = ["system", "user", "assistant"]
+CHUNK_BYTES = 32 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class LaneSchema:
+    headings: tuple[str, ...] = ()
+    required_meta: tuple[str, ...] = ()
+
+
+LANES: dict[str, LaneSchema] = {
+    "style": LaneSchema(headings=("### 结论", "### 推导", "### 检查（单位/边界条件/极限情况）")),
+    "writing": LaneSchema(headings=("### 问题诊断", "### 改进建议", "### 规范说明")),
+    "edge-swift": LaneSchema(required_meta=("task_type", "route")),
+}
+
+
+def compile_headings(headings: tuple[str, ...]) -> re.Pattern[str] | None:
+    for heading in headings:
+        if any(other != heading and other.startswith(heading) for other in headings):
+            raise ValueError(f"heading {heading!r} is a prefix of another heading; one-pass matching would miss it")
+    if not headings:
+        return None
+    return re.compile("|".join(re.escape(heading) for heading in sorted(headings, key=len, reverse=True)))
+
+
+@dataclass
+class SampleValidator:
+    lane: str
+    total: int = 0
+    missing_fields: list[str] = field(default_factory=list)
+    template_fail_ids: list[str] = field(default_factory=list)
+
+    def __post_init__(self) -> None:
+        if self.lane not in LANES:
+            raise ValueError(f"unknown lane: {self.lane}")
+        self.schema = LANES[self.lane]
+        self._pattern = compile_headings(self.schema.headings)
+
+    def update(self, row: dict[str, Any]) -> None:
+        self.total += 1
+        sid = row.get("id", "unknown")
+        for name in REQUIRED_TOP:
+            if name not in row:
+                self.missing_fields.append(f"{sid}:{name}")
+        meta = row.get("meta")
+        for name in self.schema.required_meta:
+            if not isinstance(meta, dict) or name not in meta:
+                self.missing_fields.append(f"{sid}:meta.{name}")
+        msgs = row.get("messages", [])
+        if len(msgs) < 3:
+            self.missing_fields.append(f"{sid}:messages_len")
+            return
+        if [m.get("role") for m in msgs[:3]] != EXPECTED_ROLES:
+            self.missing_fields.append(f"{sid}:roles")
+        if self._pattern is not None:
+            found = set(self._pattern.findall(msgs[2].get("content", "")))
+            if len(found) != len(self.schema.headings):
+                self.template_fail_ids.append(sid)
+
+    def update_many(self, rows: Iterable[dict[str, Any]]) -> "SampleValidator":
+        for row in rows:
+            self.update(row)
+        return self
+
+    def merge(self, other: "SampleValidator") -> None:
+        self.total += other.total
+        self.missing_fields.extend(other.missing_fields)
+        self.template_fail_ids.extend(other.template_fail_ids)
+
+    def report(self) -> dict[str, Any]:
+        template_hit = self.total - len(self.template_fail_ids)
+        return {
+            "total": self.total,
+            "parse_ok": True,
+            "field_complete": not self.missing_fields,
+            "missing_fields": self.missing_fields,
+            "template_hit_count": template_hit,
+            "template_hit_rate": 0.0 if self.total == 0 else template_hit / self.total,
+            "template_fail_ids": self.template_fail_ids,
+        }
+
+
+def validate_rows(rows: Iterable[dict[str, Any]], lane: str) -> dict[str, Any]:
+    return SampleValidator(lane).update_many(rows).report()
+
+
+def _validate_chunk(task: tuple[Path, int, int, int, str]) -> SampleValidator:
+    path, start, end, first_line, lane = task
+    return SampleValidator(lane).update_many(iter_jsonl_range(path, start, end, first_line))
+
+
+def validate_file(path: Path, lane: str, workers: int = 1, chunk_bytes: int = CHUNK_BYTES) -> dict[str, Any]:
+    """Validate a JSONL file without loading it; chunks fan out over workers and merge in file order."""
+    if workers <= 1:
+        return validate_rows(iter_jsonl(path), lane)
+    validator = SampleValidator(lane)
+    tasks = [(path, start, end, first_line, lane) for start, end, first_line in byte_ranges(path, chunk_bytes)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for partial in pool.map(_validate_chunk, tasks):
+            validator.merge(partial)
+    return validator.report()
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""Token-length statistics and sequence packing for chat-format SFT JSONL.
+
+Conversations are rendered with the tokenizer's chat template and tokenized
+in batches; the per-row lengths are cached next to the file, keyed by the
+file's content and the tokenizer, so re-runs skip tokenization. Packing bins
+rows into fixed-length sequences with best-fit-decreasing over a Fenwick tree
+of open-bin capacities, which is O(n log max_length). Each packed row keeps
+its samples plus ``cu_seqlens``/``position_ids`` so attention can be masked
+per sample. transformers is an optional dependency and is imported on first
+use.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+from array import array
+from bisect import bisect_left, bisect_right
+from contextlib import ExitStack
+from itertools import accumulate
+from pathlib import Path
+from typing import Any, Iterable
+
+from jsonl_io import CHUNK_SIZE, JsonlDataset, iter_jsonl
+
+TOKEN_BATCH_SIZE = 256
+HISTOGRAM_EDGES = (32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+
+def load_tokenizer(name_or_path: str) -> Any:
+    try:
+        from transformers import AutoTokenizer
+    except ImportError as exc:
+        raise SystemExit("Token statistics need transformers: pip install transformers") from exc
+    return AutoTokenizer.from_pretrained(name_or_path)
+
+
+def tokenizer_fingerprint(tokenizer: Any) -> str:
+    return f"{tokenizer.name_or_path}|{len(tokenizer)}|{getattr(tokenizer, 'chat_template', None)}"
+
+
+def render_conversations(tokenizer: Any, conversations: list[list[dict[str, str]]]) -> list[str]:
+    """Render messages the way training sees them; plain newline joins without a chat template."""
+    if getattr(tokenizer, "chat_template", None):
+        return tokenizer.apply_chat_template(conversations, tokenize=False)
+    return ["\n".join(str(m.get("content", "")) for m in messages) for messages in conversations]
+
+
+def _tokenize_batch(tokenizer: Any, conversations: list[list[dict[str, str]]]) -> list[int]:
+    encoded = tokenizer(render_conversations(tokenizer, conversations), add_special_tokens=False)
+    return [len(ids) for ids in encoded["input_ids"]]
+
+
+def token_lengths(path: Path, tokenizer: Any, batch_size: int = TOKEN_BATCH_SIZE, cache: bool = True) -> array:
+    """Token length of every non-blank row of a chat JSONL file, in file order."""
+    hasher = hashlib.blake2b(tokenizer_fingerprint(tokenizer).encode("utf-8"), digest_size=8)
+    with path.open("rb") as handle:
+        for chunk in iter(lambda: handle.read(CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    cache_path = path.with_name(f"{path.name}.toklens-{hasher.hexdigest()}")
+    lengths = array("I")
+    if cache and cache_path.exists():
+        lengths.frombytes(cache_path.read_bytes())
+        return lengths
+
+    batch: list[list[dict[str, str]]] = []
+    for row in iter_jsonl(path):
+        batch.append(row.get("messages", []))
+        if len(batch) >= batch_size:
+            lengths.extend(_tokenize_batch(tokenizer, batch))
+            batch = []
+    if batch:
+        lengths.extend(_tokenize_batch(tokenizer, batch))
+
+    if cache:
+        try:
+            cache_path.write_bytes(lengths.tobytes())
+        except OSError:
+            pass  # Read-only location: skip the cache.
+    return lengths
+
+
+def length_histogram(lengths: Iterable[int], edges: tuple[int, ...] = HISTOGRAM_EDGES) -> dict[str, int]:
+    labels = [f"<={edges[0]}"] + [f"{lo + 1}-{hi}" for lo, hi in zip(edges, edges[1:])] + [f">{edges[-1]}"]
+    counts = [0] * len(labels)
+    for n in lengths:
+        counts[bisect_left(edges, n)] += 1
+    return dict(zip(labels, counts))
+
+
+def length_stats(lengths: array, max_length: int) -> dict[str, Any]:
+    if not lengths:
+        return {"count": 0, "total_tokens": 0, "over_max_length": 0, "histogram": length_histogram([])}
+    ordered = sorted(lengths)
+
+    def pct(q: float) -> int:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {
+        "count": len(ordered),
+        "total_tokens": sum(ordered),
+        "min": ordered[0],
+        "max": ordered[-1],
+        "mean": round(sum(ordered) / len(ordered), 2),
+        "p50": pct(0.5),
+        "p90": pct(0.9),
+        "p99": pct(0.99),
+        "over_max_length": len(ordered) - bisect_left(ordered, max_length + 1),
+        "histogram": length_histogram(ordered),
+    }
+
+
+def pack_lengths(lengths: Iterable[int], max_length: int) -> list[list[int]]:
+    """Bin row indices into sequences of at most max_length tokens (best-fit decreasing).
+
+    Rows longer than max_length are truncated to it and get a bin of their
+    own. Items are placed longest first into the open bin with the least
+    remaining room that still fits; a Fenwick tree over remaining capacity
+    finds that bin in O(log max_length).
+    """
+    by_length: list[list[int]] = [[] for _ in range(max_length + 1)]
+    for i, n in enumerate(lengths):
+        by_length[min(max(n, 1), max_length)].append(i)
+
+    tree = [0] * (max_length + 1)
+    open_bins: list[list[int]] = [[] for _ in range(max_length + 1)]  # remaining capacity -> bin ids
+    bins: list[list[int]] = []
+    top = 1 << max_length.bit_length()
+
+    def add(cap: int, delta: int) -> None:
+        while cap <= max_length:
+            tree[cap] += delta
+            cap += cap & -cap
+
+    def prefix(cap: int) -> int:
+        total = 0
+        while cap > 0:
+            total += tree[cap]
+            cap -= cap & -cap
+        return total
+
+    def smallest_fitting(n: int) -> int:
+        """Smallest capacity >= n with an open bin, or 0 if none."""
+        target = prefix(n - 1) + 1
+        pos, step = 0, top
+        while step:
+            nxt = pos + step
+            if nxt <= max_length and tree[nxt] < target:
+                pos = nxt
+                target -= tree[nxt]
+            step >>= 1
+        return pos + 1 if pos < max_length else 0
+
+    for n in range(max_length, 0, -1):
+        for i in by_length[n]:
+            cap = smallest_fitting(n)
+            if cap:
+                b = open_bins[cap].pop()
+                add(cap, -1)
+                bins[b].append(i)
+            else:
+                b, cap = len(bins), max_length
+                bins.append([i])
+            remaining = cap - n
+            if remaining:
+                open_bins[remaining].append(b)
+                add(remaining, 1)
+    return bins
+
+
+def packing_report(lengths: array, max_length: int, bins: list[list[int]]) -> dict[str, Any]:
+    """Token slots with one row per max_length sequence vs. packed sequences."""
+    real = sum(min(n, max_length) for n in lengths)
+    unpacked_slots = len(lengths) * max_length
+    packed_slots = len(bins) * max_length
+    return {
+        "max_length": max_length,
+        "real_tokens": real,
+        "unpacked_sequences": len(lengths),
+        "packed_sequences": len(bins),
+        "unpacked_token_slots": unpacked_slots,
+        "packed_token_slots": packed_slots,
+        "saved_token_slots": unpacked_slots - packed_slots,
+        "unpacked_padding_ratio": round(1 - real / unpacked_slots, 6) if unpacked_slots else 0.0,
+        "packed_padding_ratio": round(1 - real / packed_slots, 6) if packed_slots else 0.0,
+        "truncated_rows": sum(1 for n in lengths if n > max_length),
+    }
+
+
+def packed_row(pack_id: str, samples: list[dict[str, Any]], sizes: list[int]) -> dict[str, Any]:
+    """One packed sequence with per-sample boundaries for attention masking.
+
+    ``cu_seqlens`` are the cumulative sample boundaries (flash-attention
+    varlen layout) and ``position_ids`` restart at 0 for every sample.
+    """
+    cu_seqlens = [0]
+    for size in sizes:
+        cu_seqlens.append(cu_seqlens[-1] + size)
+    return {
+        "id": pack_id,
+        "num_tokens": cu_seqlens[-1],
+        "lengths": sizes,
+        "cu_seqlens": cu_seqlens,
+        "position_ids": [pos for size in sizes for pos in range(size)],
+        "samples": samples,
+    }
+
+
+def write_packed(
+    src: Path | list[Path], dst: Path, bins: list[list[int]], lengths: array, max_length: int, id_prefix: str
+) -> int:
+    """Write one JSONL row per packed sequence holding its source rows; returns the row count.
+
+    Indices in ``bins`` run over the non-blank rows of ``src`` in order (files
+    concatenated); rows are fetched by random access through JsonlDataset.
+    """
+    sources = [src] if isinstance(src, Path) else list(src)
+    with ExitStack() as stack:
+        datasets = [stack.enter_context(JsonlDataset(path)) for path in sources]
+        starts = list(accumulate((len(d) for d in datasets), initial=0))
+        out = stack.enter_context(dst.open("w", encoding="utf-8"))
+
+        def fetch(i: int) -> dict[str, Any]:
+            f = bisect_right(starts, i) - 1
+            return datasets[f][i - starts[f]]
+
+        for k, members in enumerate(bins, 1):
+            sizes = [min(lengths[i], max_length) for i in members]
+            row = packed_row(f"{id_prefix}-{k:06d}", [fetch(i) for i in members], sizes)
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+    return len(bins)
+
+
+def pack_files(
+    inputs: list[Path],
+    output: Path,
+    tokenizer: Any,
+    max_length: int,
+    id_prefix: str = "pack",
+    batch_size: int = TOKEN_BATCH_SIZE,
+) -> dict[str, Any]:
+    """Tokenize (cached), pack and write chat JSONL files; returns length stats and the packing report."""
+    lengths = array("I")
+    for path in inputs:
+        lengths.extend(token_lengths(path, tokenizer, batch_size=batch_size))
+    bins = pack_lengths(lengths, max_length)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    write_packed(inputs, output, bins, lengths, max_length, id_prefix)
+    return {
+        "inputs": [str(path) for path in inputs],
+        "output": str(output),
+        "token_lengths": length_stats(lengths, max_length),
+        "packing": packing_report(lengths, max_length, bins),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Pack chat-format SFT JSONL into fixed-length sequences.")
+    parser.add_argument("--input", required=True, nargs="+", type=Path, help="Chat JSONL file(s) with messages.")
+    parser.add_argument("--output", required=True, type=Path, help="Packed JSONL output.")
+    parser.add_argument("--tokenizer", required=True, help="Tokenizer name/path used to measure lengths.")
+    parser.add_argument("--max-length", type=int, default=2048, help="Tokens per packed sequence.")
+    parser.add_argument("--token-batch-size", type=int, default=TOKEN_BATCH_SIZE, help="Rows per tokenizer call.")
+    parser.add_argument("--id-prefix", default="pack", help="Prefix of packed row ids.")
+    parser.add_argument("--report", type=Path, default=None, help="Optional report JSON path.")
+    args = parser.parse_args()
+
+    report = pack_files(
+        args.input, args.output, load_tokenizer(args.tokenizer), args.max_length, args.id_prefix, args.token_batch_size
+    )
+    if args.report is not None:
+        args.report.parent.mkdir(parents=True, exist_ok=True)
+        args.report.write_text(json.dumps(report, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+    print(json.dumps(report["packing"], ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+"""The scripts under scripts/ai import each other as top-level modules."""
+
+import sys
+from pathlib import Path
+
+AI_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(AI_DIR))
@@ -0,0 +1,131 @@
+"""distill_data.py end to end: the CLI is run in a subprocess on small corpora."""
+
+from __future__ import annotations
+
+import json
+import subprocess
+import sys
+import zlib
+from pathlib import Path
+
+import pytest
+
+DISTILL = Path(__file__).resolve().parents[1] / "distill_data.py"
+
+
+def chat(i: int, answer: str) -> dict:
+    return {
+        "id": i,
+        "mode": "qa",
+        "messages": [
+            {"role": "system", "content": "你是学习助手。"},
+            {"role": "user", "content": f"问题 {i}"},
+            {"role": "assistant", "content": answer},
+        ],
+        "meta": {"lane": "style"},
+    }
+
+
+def write_corpus(directory: Path, files: int = 4, rows: int = 30) -> list[Path]:
+    """Chat JSONL shards with cross-file duplicates, malformed rows and blank lines."""
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for f in range(files):
+        lines = []
+        for r in range(rows):
+            i = f * rows + r
+            if r % 7 == 3:
+                lines.append(json.dumps({"id": i, "text": "no messages"}))
+            elif r % 11 == 5:
+                lines.append("")
+            else:
+                # i % 40 repeats across shards, so dedup has to work globally.
+                lines.append(json.dumps(chat(i % 40, f"回答 {i % 40}"), ensure_ascii=False))
+        path = directory / f"part_{f}.jsonl"
+        path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        paths.append(path)
+    return paths
+
+
+def distill(inputs: list[Path], output: Path, *args: str) -> dict:
+    report = output.with_suffix(".report.json")
+    subprocess.run(
+        [sys.executable, str(DISTILL), "--input", *map(str, inputs), "--output", str(output), "--report", str(report), *args],
+        check=True,
+    )
+    return json.loads(report.read_text(encoding="utf-8"))
+
+
+@pytest.mark.parametrize("extra", [[], ["--near-dup-threshold", "0.8"]])
+def test_workers_match_serial(tmp_path: Path, extra: list[str]) -> None:
+    inputs = write_corpus(tmp_path / "in")
+    serial = distill(inputs, tmp_path / "serial.jsonl", *extra)
+    parallel = distill(inputs, tmp_path / "parallel.jsonl", "--workers", "3", *extra)
+
+    assert (tmp_path / "parallel.jsonl").read_bytes() == (tmp_path / "serial.jsonl").read_bytes()
+    for key in ("total_records", "distilled_records", "dropped", "dedup_index_size"):
+        assert parallel[key] == serial[key]
+    assert serial["dropped"]["duplicate"] > 0
+    if not extra:
+        assert serial["distilled_records"] == 40
+
+
+def test_near_dup_drops_stay_eligible_for_later_runs(tmp_path: Path) -> None:
+    inputs = write_corpus(tmp_path / "in")
+    index = tmp_path / "dedup.sqlite"
+
+    first = distill(inputs, tmp_path / "run1.jsonl", "--dedup-index", str(index), "--near-dup-threshold", "0.8")
+    assert first["dropped"]["near_duplicate"] > 0
+    assert first["dedup_index_size"] == first["distilled_records"]
+
+    # Without near-dup the records dropped above are new; only run 1's output is skipped.
+    second = distill(inputs, tmp_path / "run2.jsonl", "--dedup-index", str(index))
+    assert second["incremental_skipped"] > 0
+    assert second["distilled_records"] == 40 - first["distilled_records"]
+    emitted = [
+        json.loads(line)["id"]
+        for run in ("run1.jsonl", "run2.jsonl")
+        for line in (tmp_path / run).read_text(encoding="utf-8").splitlines()
+    ]
+    assert sorted(emitted) == list(range(40))
+
+    third = distill(inputs, tmp_path / "run3.jsonl", "--dedup-index", str(index))
+    assert third["distilled_records"] == 0
+    assert third["dedup_index_size"] == 40
+
+
+def reference_signature(index, text: str) -> list[int]:
+    """Pure-Python MinHash: exact big-int arithmetic mod 2^61 - 1."""
+    from distill_data import MAX_HASH, MERSENNE_PRIME
+
+    text = index.normalize(text)
+    size = index.shingle_size
+    shingles = {zlib.crc32(text[i : i + size].encode("utf-8")) for i in range(max(len(text) - size + 1, 1))}
+    a = ((index._a_hi << 32) | index._a_lo)[:, 0].tolist()
+    b = index._b[:, 0].tolist()
+    return [min(((ai * x + bi) % MERSENNE_PRIME) & MAX_HASH for x in shingles) for ai, bi in zip(a, b)]
+
+
+def test_minhash_signature_matches_exact_arithmetic() -> None:
+    from distill_data import NearDupIndex
+
+    index = NearDupIndex(0.8, num_perm=64)
+    for text in ("", "短", "第 3 章：函数的极限与连续性，例题 12。", "x" * 500):
+        assert index.signature(text).tolist() == reference_signature(index, text)
+
+
+def test_lsh_banding() -> None:
+    from distill_data import NearDupIndex, choose_bands
+
+    for num_perm, threshold in ((128, 0.8), (128, 0.5), (64, 0.9), (7, 0.7)):
+        bands, rows = choose_bands(num_perm, threshold)
+        assert bands * rows == num_perm
+
+    index = NearDupIndex(0.8)
+    template = "请根据第 {n} 章的内容，总结函数极限的定义、性质以及常见的求解方法，并给出例题。"
+    assert index.add(template.format(n=1)) is None
+    # Digit runs and whitespace are normalized away, so templated variants collide.
+    assert index.add(template.format(n=27)) == 0
+    assert index.add("  " + template.format(n=3).replace("，", " ，")) == 0
+    assert index.add("解释牛顿第二定律在匀加速直线运动中的应用，并推导位移公式。") is None
+    assert index.clusters == {0}
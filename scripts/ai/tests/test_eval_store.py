@@ -0,0 +1,34 @@
+"""Cross-run queries in eval_store.py."""
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+from eval_store import EvalStore
+
+PASS = {"key_points_total": 2, "key_points_hit": 2, "response_format": True}
+MISS = {"key_points_total": 2, "key_points_hit": 1, "response_format": True}
+BAD_FORMAT = {"key_points_total": 0, "response_format": False}
+
+
+def write_run(run_dir: Path, results: dict[str, dict]) -> Path:
+    run_dir.mkdir(parents=True)
+    details = [{"id": sample_id, "type": "qa", "result": result} for sample_id, result in results.items()]
+    (run_dir / "eval_report_all.json").write_text(json.dumps({"details": details}), encoding="utf-8")
+    return run_dir
+
+
+def test_diff_newly_failing_and_fixed(tmp_path: Path) -> None:
+    old = write_run(tmp_path / "old", {"a": MISS, "b": PASS, "c": MISS, "d": BAD_FORMAT, "e": PASS})
+    new = write_run(tmp_path / "new", {"a": PASS, "b": MISS, "d": MISS, "e": PASS})  # c was not evaluated
+
+    with EvalStore(tmp_path / "eval.sqlite") as store:
+        assert store.ingest_run(old) == {"all": True}
+        assert store.ingest_run(new) == {"all": True}
+        assert store.ingest_run(new) == {"all": False}
+        diff = store.diff("new", "old", "all")
+
+    assert diff["newly_failing"] == ["b"]
+    assert diff["fixed"] == ["a"]
+    assert diff["newly_failing_by_bucket"]["key_points_miss"] == ["b", "d"]
@@ -0,0 +1,133 @@
+"""Range splitting and JsonlDataset random access (with its ``.idx`` sidecar) in jsonl_io.py."""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from jsonl_io import JsonlDataset, byte_ranges, imap_bounded, iter_jsonl, iter_jsonl_range
+
+
+def write_rows(path: Path, rows: list[dict], blank_every: int = 0) -> None:
+    lines = []
+    for i, row in enumerate(rows):
+        if blank_every and i % blank_every == 0:
+            lines.append("   ")
+        lines.append(json.dumps(row, ensure_ascii=False))
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def test_random_access_skips_blank_lines(tmp_path: Path) -> None:
+    path = tmp_path / "data.jsonl"
+    rows = [{"id": i, "text": f"第 {i} 行"} for i in range(20)]
+    write_rows(path, rows, blank_every=3)
+    with JsonlDataset(path) as dataset:
+        assert len(dataset) == 20
+        assert list(dataset) == rows
+        assert dataset[-1] == rows[-1]
+        assert dataset[5:8] == rows[5:8]
+        assert dataset.take(3) == rows[:3]
+        assert sorted(row["id"] for row in dataset.sample(20, seed=1)) == list(range(20))
+        with pytest.raises(IndexError):
+            dataset[20]
+    assert path.with_name("data.jsonl.idx").exists()
+
+
+def test_index_is_reused_while_file_is_unchanged(tmp_path: Path) -> None:
+    path = tmp_path / "data.jsonl"
+    write_rows(path, [{"id": i} for i in range(5)])
+    JsonlDataset(path).close()
+    index = path.with_name("data.jsonl.idx")
+    built = index.stat().st_mtime_ns
+    os.utime(index, ns=(built - 10**9, built - 10**9))
+
+    with JsonlDataset(path) as dataset:
+        assert len(dataset) == 5
+    assert index.stat().st_mtime_ns == built - 10**9
+
+
+def test_index_is_rebuilt_when_file_changes(tmp_path: Path) -> None:
+    path = tmp_path / "data.jsonl"
+    write_rows(path, [{"id": i} for i in range(5)])
+    JsonlDataset(path).close()
+
+    # Appended rows change the size.
+    with path.open("a", encoding="utf-8") as handle:
+        handle.write(json.dumps({"id": 5}) + "\n")
+    with JsonlDataset(path) as dataset:
+        assert [row["id"] for row in dataset] == list(range(6))
+
+    # Same size, different line layout: only the mtime changes.
+    stat = path.stat()
+    path.write_text(path.read_text(encoding="utf-8").replace('{"id": 0}\n{"id": 1}', '{"id": 9, "k": 0}\n\n'))
+    assert path.stat().st_size == stat.st_size
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    with JsonlDataset(path) as dataset:
+        assert [row["id"] for row in dataset] == [9, 2, 3, 4, 5]
+
+
+def test_corrupt_or_unwritable_index(tmp_path: Path) -> None:
+    path = tmp_path / "data.jsonl"
+    write_rows(path, [{"id": i} for i in range(4)])
+    index = path.with_name("data.jsonl.idx")
+    index.write_bytes(b"garbage")
+    with JsonlDataset(path) as dataset:
+        assert len(dataset) == 4
+    assert index.stat().st_size > len(b"garbage")
+
+    with JsonlDataset(path, index_path=tmp_path / "missing" / "data.idx") as dataset:
+        assert [row["id"] for row in dataset] == list(range(4))
+
+
+def test_invalid_json_reports_line_number(tmp_path: Path) -> None:
+    path = tmp_path / "data.jsonl"
+    path.write_text('{"id": 0}\n\n{"id": \n', encoding="utf-8")
+    with JsonlDataset(path) as dataset:
+        assert dataset[0] == {"id": 0}
+        with pytest.raises(ValueError, match=r"data\.jsonl:3"):
+            dataset[1]
+
+
+@pytest.mark.parametrize("chunk_bytes", [1, 7, 64, 10**6])
+def test_byte_ranges_cover_every_line_once(tmp_path: Path, chunk_bytes: int) -> None:
+    path = tmp_path / "data.jsonl"
+    write_rows(path, [{"id": i, "text": "x" * (i % 9)} for i in range(30)], blank_every=4)
+    # Last line without a trailing newline.
+    path.write_text(path.read_text(encoding="utf-8") + '{"id": "last"}', encoding="utf-8")
+    ranges = byte_ranges(path, chunk_bytes)
+    assert ranges[0][0] == 0 and ranges[-1][1] == path.stat().st_size
+    assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+    rows = [row for start, end, first_line in ranges for row in iter_jsonl_range(path, start, end, first_line)]
+    assert rows == list(iter_jsonl(path))
+
+    lines = path.read_text(encoding="utf-8").split("\n")
+    lines[17] = '{"id": '
+    path.write_text("\n".join(lines), encoding="utf-8")
+    with pytest.raises(ValueError, match=r"data\.jsonl:18$"):
+        for start, end, first_line in byte_ranges(path, chunk_bytes):
+            list(iter_jsonl_range(path, start, end, first_line))
+
+
+def test_imap_bounded_keeps_order_and_window() -> None:
+    lock = threading.Lock()
+    state = {"running": 0, "peak": 0}
+
+    def work(i: int) -> int:
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        time.sleep(0.001 * (i % 3))
+        with lock:
+            state["running"] -= 1
+        return i * i
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = imap_bounded(pool, work, range(50), window=3)
+        assert list(results) == [i * i for i in range(50)]
+    assert state["peak"] <= 3
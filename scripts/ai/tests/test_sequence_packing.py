@@ -0,0 +1,80 @@
+"""Best-fit-decreasing packing and packed-row layout in sequence_packing.py."""
+
+from __future__ import annotations
+
+import json
+import random
+from array import array
+from pathlib import Path
+
+import pytest
+
+from sequence_packing import pack_lengths, packing_report, write_packed
+
+
+def naive_best_fit_decreasing(lengths: list[int], max_length: int) -> list[int]:
+    """Sorted bin loads from an O(n^2) best-fit-decreasing reference."""
+    loads: list[int] = []
+    for n in sorted((min(max(n, 1), max_length) for n in lengths), reverse=True):
+        fitting = [b for b, load in enumerate(loads) if load + n <= max_length]
+        if fitting:
+            best = max(fitting, key=lambda b: loads[b])
+            loads[best] += n
+        else:
+            loads.append(n)
+    return sorted(loads)
+
+
+def random_lengths(seed: int, count: int, max_length: int) -> list[int]:
+    rng = random.Random(seed)
+    return [rng.randint(1, max_length + max_length // 4) for _ in range(count)]
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("max_length", [16, 100, 2048])
+def test_pack_lengths_invariants(seed: int, max_length: int) -> None:
+    lengths = random_lengths(seed, 300, max_length)
+    bins = pack_lengths(lengths, max_length)
+
+    members = sorted(i for members in bins for i in members)
+    assert members == list(range(len(lengths)))
+    loads = [sum(min(lengths[i], max_length) for i in members) for members in bins]
+    assert all(0 < load <= max_length for load in loads)
+    assert sorted(loads) == naive_best_fit_decreasing(lengths, max_length)
+    assert len(bins) >= -(-sum(min(n, max_length) for n in lengths) // max_length)
+
+
+def test_packing_report_counts() -> None:
+    lengths = array("I", [10, 6, 4, 12, 3])
+    bins = pack_lengths(lengths, 10)
+    report = packing_report(lengths, 10, bins)
+    assert report["real_tokens"] == 33
+    assert report["packed_sequences"] == len(bins) == 4
+    assert report["truncated_rows"] == 1
+    assert report["saved_token_slots"] == (5 - 4) * 10
+
+
+def test_write_packed_rows(tmp_path: Path) -> None:
+    files = [tmp_path / "style.jsonl", tmp_path / "writing.jsonl"]
+    rows = [{"id": f"s{i}", "messages": []} for i in range(7)]
+    files[0].write_text("".join(json.dumps(row) + "\n" for row in rows[:4]) + "\n", encoding="utf-8")
+    files[1].write_text("".join(json.dumps(row) + "\n" for row in rows[4:]), encoding="utf-8")
+    lengths = array("I", [5, 3, 8, 2, 7, 12, 1])
+    max_length = 10
+
+    bins = pack_lengths(lengths, max_length)
+    output = tmp_path / "packed.jsonl"
+    assert write_packed(files, output, bins, lengths, max_length, "pack") == len(bins)
+
+    packed = [json.loads(line) for line in output.read_text(encoding="utf-8").splitlines()]
+    assert [row["id"] for row in packed] == [f"pack-{k:06d}" for k in range(1, len(bins) + 1)]
+    seen = []
+    for row, members in zip(packed, bins):
+        sizes = [min(lengths[i], max_length) for i in members]
+        assert row["lengths"] == sizes
+        assert row["num_tokens"] == sum(sizes) <= max_length
+        assert row["cu_seqlens"] == [sum(sizes[:k]) for k in range(len(sizes) + 1)]
+        assert row["position_ids"] == [p for size in sizes for p in range(size)]
+        assert row["samples"] == [rows[i] for i in members]
+        seen.extend(sample["id"] for sample in row["samples"])
+    assert sorted(seen) == sorted(row["id"] for row in rows)
@@ -0,0 +1,61 @@
+"""Smoke language models in train_smoke.py."""
+
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from train_smoke import KneserNeyModel, TokenizedCorpus, build_language_model
+
+RESPONSES = [
+    "the cat sat on the mat",
+    "the dog sat on the log",
+    "a cat and a dog sat together",
+    "the mat is on the floor",
+    "on the floor the cat sat",
+]
+
+
+def corpus() -> TokenizedCorpus:
+    return TokenizedCorpus.from_records({"response": text} for text in RESPONSES)
+
+
+def next_token_distribution(model: KneserNeyModel, history: list[int]) -> np.ndarray:
+    """P(w | history) for every w in the vocabulary plus the OOV id."""
+    candidates = np.arange(model.vocab_size + 1, dtype=np.int64)
+    rows = len(history) + 1
+    ids = np.concatenate([np.append(np.asarray(history, dtype=np.int64), w) for w in candidates])
+    offsets = np.arange(0, len(ids) + 1, rows, dtype=np.int64)
+    return model.token_probs(ids, offsets)[rows - 1 :: rows]
+
+
+@pytest.mark.parametrize("order", [2, 3, 4])
+def test_kneser_ney_distributions_sum_to_one(order: int) -> None:
+    train = corpus()
+    unigram = build_language_model(train)
+    ids = unigram.model_ids(train)
+    model = KneserNeyModel(ids, train.offsets, len(unigram.vocab), order)
+    oov = len(unigram.vocab)
+    vocab = unigram.vocab
+
+    histories = [
+        [],
+        [vocab["the"]],
+        [vocab["on"], vocab["the"]],
+        [vocab["sat"], vocab["on"], vocab["the"]],
+        [vocab["floor"], vocab["cat"]],  # unseen bigram history
+        [oov, oov],
+    ]
+    for history in histories:
+        probs = next_token_distribution(model, history)
+        assert (probs > 0).all()
+        assert probs.sum() == pytest.approx(1.0, abs=1e-9)
+
+
+def test_kneser_ney_prefers_seen_continuations() -> None:
+    train = corpus()
+    unigram = build_language_model(train)
+    model = KneserNeyModel(unigram.model_ids(train), train.offsets, len(unigram.vocab), 3)
+    vocab = unigram.vocab
+    probs = next_token_distribution(model, [vocab["sat"], vocab["on"]])
+    assert probs.argmax() == vocab["the"]
@@ -2,55 +2,231 @@
 from __future__ import annotations
 
 import argparse
+import hashlib
 import json
 import math
 import re
+from array import array
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
 from typing import Iterable
 
+import numpy as np
+
+from columnar_io import ColumnarDataset, detect_format
+from jsonl_io import byte_ranges, imap_bounded, iter_jsonl, iter_jsonl_range
+
 TOKEN_PATTERN = re.compile(r"\S+")
+EVAL_CHUNK_TOKENS = 1 << 22
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_DISCOUNT = 0.75
 
 
-def iter_jsonl(path: Path) -> Iterable[dict]:
-    with path.open("r", encoding="utf-8") as handle:
-        for line_num, line in enumerate(handle, start=1):
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                yield json.loads(line)
-            except json.JSONDecodeError as exc:
-                raise ValueError(f"Invalid JSON in {path}:{line_num}") from exc
+def open_dataset(path: Path) -> Iterable[dict]:
+    """Stream distilled JSONL, or Parquet/Arrow projected to the response column.
+
+    Records are read once in order, so JSONL is streamed without building a
+    line index (no ``.idx`` sidecar next to the input).
+    """
+    if detect_format(path):
+        return ColumnarDataset(path, columns=["response"])
+    return iter_jsonl(path)
 
 
 def tokenize(text: str) -> list[str]:
     return TOKEN_PATTERN.findall(text)
 
 
-def build_language_model(records: Iterable[dict]) -> tuple[Counter, int]:
-    counts = Counter()
-    total = 0
-    for record in records:
-        response = record.get("response") or ""
-        tokens = tokenize(response)
-        counts.update(tokens)
-        total += len(tokens)
-    return counts, total
-
-
-def evaluate(records: Iterable[dict], counts: Counter, total: int) -> dict:
-    vocab_size = max(len(counts), 1)
-    total_tokens = 0
-    nll = 0.0
-    for record in records:
-        response = record.get("response") or ""
-        tokens = tokenize(response)
-        for token in tokens:
-            token_count = counts.get(token, 0)
-            prob = (token_count + 1) / (total + vocab_size)
-            nll -= math.log(prob)
-        total_tokens += len(tokens)
+def file_digest(path: Path) -> str:
+    """Content hash of a file plus the tokenizer pattern, used as the cache key."""
+    hasher = hashlib.blake2b(TOKEN_PATTERN.pattern.encode("utf-8"), digest_size=16)
+    with path.open("rb") as handle:
+        for chunk in iter(lambda: handle.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class TokenizedCorpus:
+    """Responses tokenized once into a flat int32 id array with per-record offsets.
+
+    Ids index the corpus-local ``vocab``; ``offsets[i]:offsets[i + 1]`` spans
+    record i.
+    """
+
+    def __init__(self, vocab: list[str], ids: np.ndarray, offsets: np.ndarray) -> None:
+        self.vocab = vocab
+        self.ids = ids
+        self.offsets = offsets
+
+    @property
+    def num_records(self) -> int:
+        return len(self.offsets) - 1
+
+    @classmethod
+    def from_records(cls, records: Iterable[dict]) -> "TokenizedCorpus":
+        index: dict[str, int] = {}
+        setdefault = index.setdefault
+        ids = array("i")
+        offsets = array("q", [0])
+        for record in records:
+            ids.extend([setdefault(token, len(index)) for token in tokenize(record.get("response") or "")])
+            offsets.append(len(ids))
+        return cls(
+            list(index),
+            np.frombuffer(ids, dtype=np.int32) if ids else np.zeros(0, dtype=np.int32),
+            np.frombuffer(offsets, dtype=np.int64),
+        )
+
+    @classmethod
+    def load(cls, cache_path: Path) -> "TokenizedCorpus":
+        with np.load(cache_path) as data:
+            vocab_blob = data["vocab"].tobytes().decode("utf-8")
+            return cls(vocab_blob.split("\n") if vocab_blob else [], data["ids"], data["offsets"])
+
+    def save(self, cache_path: Path) -> None:
+        # Tokens never contain whitespace, so newline-joined UTF-8 round-trips the vocab.
+        vocab_blob = np.frombuffer("\n".join(self.vocab).encode("utf-8"), dtype=np.uint8)
+        with cache_path.open("wb") as handle:
+            np.savez(handle, vocab=vocab_blob, ids=self.ids, offsets=self.offsets)
+
+
+def load_corpus(path: Path, cache: bool = False) -> TokenizedCorpus:
+    """Tokenize a dataset, reusing a ``<file>.tokens-<hash>.npz`` cache when enabled."""
+    if not cache:
+        return TokenizedCorpus.from_records(open_dataset(path))
+    cache_path = path.with_name(f"{path.name}.tokens-{file_digest(path)}.npz")
+    if cache_path.exists():
+        return TokenizedCorpus.load(cache_path)
+    corpus = TokenizedCorpus.from_records(open_dataset(path))
+    try:
+        corpus.save(cache_path)
+    except OSError:
+        pass  # Read-only location: run without persisting the cache.
+    return corpus
+
+
+class UnigramModel:
+    """Add-one smoothed unigram LM over integer token ids.
+
+    Log-probabilities are precomputed per vocab entry, with one extra slot for
+    out-of-vocabulary tokens, so scoring token ids is a single gather-and-sum.
+    """
+
+    def __init__(self, vocab: list[str], counts: np.ndarray) -> None:
+        self.vocab = {token: i for i, token in enumerate(vocab)}
+        self.counts = counts.astype(np.int64, copy=False)
+        self.total = int(self.counts.sum())
+        self.oov_id = len(self.vocab)
+        denominator = self.total + max(len(self.vocab), 1)
+        self.log_probs = np.log(np.append(self.counts, 0) + 1.0) - math.log(denominator)
+
+    def model_ids(self, corpus: TokenizedCorpus) -> np.ndarray:
+        """Translate corpus-local ids to model ids (one lookup per distinct token)."""
+        remap = np.fromiter(
+            map(self.vocab.get, corpus.vocab, repeat(self.oov_id)), dtype=np.int64, count=len(corpus.vocab)
+        )
+        return remap[corpus.ids] if len(corpus.ids) else np.zeros(0, dtype=np.int64)
+
+    def nll(self, ids: np.ndarray) -> float:
+        return float(-self.log_probs[ids].sum())
+
+
+def build_language_model(corpus: TokenizedCorpus) -> UnigramModel:
+    counts = np.bincount(corpus.ids, minlength=len(corpus.vocab))
+    return UnigramModel(corpus.vocab, counts)
+
+
+def lookup(keys: np.ndarray, values: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """Vectorized lookup in a sorted key table; missing keys map to 0."""
+    if not len(keys):
+        return np.zeros(len(query), dtype=values.dtype)
+    idx = np.minimum(np.searchsorted(keys, query), len(keys) - 1)
+    return np.where(keys[idx] == query, values[idx], 0)
+
+
+def discount(counts: np.ndarray) -> float:
+    """Kneser-Ney discount D = n1 / (n1 + 2 * n2) from count-of-counts."""
+    n1 = int(np.count_nonzero(counts == 1))
+    n2 = int(np.count_nonzero(counts == 2))
+    return n1 / (n1 + 2 * n2) if n1 and n2 else DEFAULT_DISCOUNT
+
+
+class KneserNeyModel:
+    """Interpolated Kneser-Ney n-gram model over packed n-gram keys.
+
+    Each order keeps sorted int64 keys (token ids packed ``bits`` apart) with
+    parallel count arrays: raw counts for the highest order and continuation
+    counts (distinct left extensions) below it. Histories are padded with a
+    BOS id so contexts never cross record boundaries. Build and scoring are
+    sorts, searches and gathers over whole arrays, linear-ish in corpus size.
+    """
+
+    def __init__(self, ids: np.ndarray, offsets: np.ndarray, vocab_size: int, order: int) -> None:
+        self.order = order
+        self.vocab_size = vocab_size
+        self.bos_id = vocab_size + 1  # vocab_size itself is the OOV id.
+        self.bits = max(self.bos_id.bit_length(), 1)
+        if order * self.bits > 63:
+            raise ValueError(f"vocabulary of {vocab_size} is too large to pack order-{order} keys into int64")
+
+        keys = np.unique(self.ngram_keys(ids, offsets, order), return_counts=True)
+        self.tables: dict[int, tuple[np.ndarray, np.ndarray]] = {order: keys}
+        for k in range(order - 1, 0, -1):
+            suffixes = self.tables[k + 1][0] & ((1 << (k * self.bits)) - 1)
+            self.tables[k] = np.unique(suffixes, return_counts=True)
+
+        self.discounts = {k: discount(counts) for k, (_, counts) in self.tables.items()}
+        self.contexts: dict[int, tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        for k in range(2, order + 1):
+            table_keys, counts = self.tables[k]
+            histories, starts = np.unique(table_keys >> self.bits, return_index=True)
+            totals = np.add.reduceat(counts, starts) if len(starts) else counts[:0]
+            types = np.diff(np.append(starts, len(table_keys)))
+            self.contexts[k] = (histories, totals, types)
+
+    def ngram_keys(self, ids: np.ndarray, offsets: np.ndarray, k: int) -> np.ndarray:
+        """Packed key of the k-gram ending at every token, BOS-padded per record."""
+        pad = self.order - 1
+        lengths = np.diff(offsets)
+        positions = np.arange(len(ids), dtype=np.int64) + pad * np.repeat(
+            np.arange(1, len(lengths) + 1, dtype=np.int64), lengths
+        )
+        padded = np.full(len(ids) + pad * len(lengths), self.bos_id, dtype=np.int64)
+        padded[positions] = ids
+        keys = np.zeros(len(ids), dtype=np.int64)
+        for j in range(k):
+            keys = (keys << self.bits) | padded[positions - (k - 1) + j]
+        return keys
+
+    def token_probs(self, ids: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+        unigram_keys, unigram_counts = self.tables[1]
+        total = unigram_counts.sum()
+        uniform = 1.0 / (self.vocab_size + 1)
+        if not total:
+            return np.full(len(ids), uniform)
+        d = self.discounts[1]
+        probs = np.maximum(lookup(unigram_keys, unigram_counts, ids) - d, 0) / total
+        probs += d * len(unigram_keys) / total * uniform
+        for k in range(2, self.order + 1):
+            table_keys, counts = self.tables[k]
+            histories, totals, types = self.contexts[k]
+            keys = self.ngram_keys(ids, offsets, k)
+            history_total = lookup(histories, totals, keys >> self.bits)
+            history_types = lookup(histories, types, keys >> self.bits)
+            seen = history_total > 0
+            safe_total = np.where(seen, history_total, 1)
+            d = self.discounts[k]
+            interpolated = (
+                np.maximum(lookup(table_keys, counts, keys) - d, 0) / safe_total
+                + d * history_types / safe_total * probs
+            )
+            probs = np.where(seen, interpolated, probs)
+        return probs
+
+
+def summarize(total_tokens: int, nll: float) -> dict:
     avg_nll = nll / total_tokens if total_tokens else 0.0
     perplexity = math.exp(avg_nll) if total_tokens else 0.0
     return {
@@ -60,11 +236,119 @@ def evaluate(records: Iterable[dict], counts: Counter, total: int) -> dict:
     }
 
 
+def evaluate(
+    corpus: TokenizedCorpus,
+    model: UnigramModel,
+    ngram_models: Iterable[KneserNeyModel] = (),
+    chunk_tokens: int = EVAL_CHUNK_TOKENS,
+) -> dict:
+    ids = model.model_ids(corpus)
+    total_tokens = len(ids)
+    nll = sum(model.nll(ids[start : start + chunk_tokens]) for start in range(0, total_tokens, chunk_tokens))
+    result = summarize(total_tokens, nll)
+    perplexity = result["perplexity"]
+    ngram_models = list(ngram_models)
+    if ngram_models:
+        by_order = {"1": perplexity}
+        for ngram in ngram_models:
+            order_nll = float(-np.log(ngram.token_probs(ids, corpus.offsets)).sum())
+            by_order[str(ngram.order)] = math.exp(order_nll / total_tokens) if total_tokens else 0.0
+        result["perplexity_by_order"] = by_order
+    return result
+
+
+def count_chunk(task: tuple[Path, int, int, int]) -> tuple[int, Counter]:
+    """Worker: token counts for the records in one byte range of a JSONL file."""
+    path, start, end, first_line = task
+    records = 0
+    counts = Counter()
+    for record in iter_jsonl_range(path, start, end, first_line):
+        counts.update(tokenize(record.get("response") or ""))
+        records += 1
+    return records, counts
+
+
+_SCORER: tuple[dict[str, int], np.ndarray] | None = None
+
+
+def init_scorer(vocab: list[str], log_probs: np.ndarray) -> None:
+    global _SCORER
+    _SCORER = ({token: i for i, token in enumerate(vocab)}, log_probs)
+
+
+def score_chunk(task: tuple[Path, int, int, int]) -> tuple[int, int, float]:
+    """Worker: (records, tokens, nll) for one byte range under the pool's unigram model."""
+    path, start, end, first_line = task
+    vocab, log_probs = _SCORER
+    oov_id = len(vocab)
+    ids = array("q")
+    records = 0
+    for record in iter_jsonl_range(path, start, end, first_line):
+        ids.extend(map(vocab.get, tokenize(record.get("response") or ""), repeat(oov_id)))
+        records += 1
+    return records, len(ids), float(-log_probs[np.frombuffer(ids, dtype=np.int64)].sum()) if ids else 0.0
+
+
+def run_streaming(train_path: Path, eval_path: Path, workers: int, chunk_bytes: int) -> dict:
+    """Unigram smoke metrics with bounded memory: both files are streamed in byte
+    chunks across a process pool, and workers return partial counts / NLL sums.
+    At most 2 * workers chunks are in flight; each partial is merged as it arrives."""
+    train_tasks = [(train_path, *span) for span in byte_ranges(train_path, chunk_bytes)]
+    eval_tasks = [(eval_path, *span) for span in byte_ranges(eval_path, chunk_bytes)]
+
+    window = 2 * workers
+    counts = Counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for _, partial in imap_bounded(pool, count_chunk, train_tasks, window):
+            counts.update(partial)
+    model = UnigramModel(list(counts), np.fromiter(counts.values(), dtype=np.int64, count=len(counts)))
+    del counts
+
+    results = {}
+    scorer_args = (list(model.vocab), model.log_probs)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_scorer, initargs=scorer_args) as pool:
+        for split, tasks in (("train", train_tasks), ("eval", eval_tasks)):
+            records = tokens = 0
+            nll = 0.0
+            for part_records, part_tokens, part_nll in imap_bounded(pool, score_chunk, tasks, window):
+                records += part_records
+                tokens += part_tokens
+                nll += part_nll
+            results[split] = (records, summarize(tokens, nll))
+
+    return {
+        "train_records": results["train"][0],
+        "eval_records": results["eval"][0],
+        "vocab_size": len(model.vocab),
+        "ngram_order": 1,
+        "train": results["train"][1],
+        "eval": results["eval"][1],
+    }
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(description="Run a smoke-test training loop on distilled data.")
-    parser.add_argument("--train", required=True, help="Distilled training JSONL file.")
-    parser.add_argument("--eval", required=True, help="Distilled eval JSONL file.")
+    parser.add_argument("--train", required=True, help="Distilled training file (JSONL, Parquet or Arrow).")
+    parser.add_argument("--eval", required=True, help="Distilled eval file (JSONL, Parquet or Arrow).")
     parser.add_argument("--metrics", default="outputs/smoke_train_metrics.json", help="Metrics output path.")
+    parser.add_argument(
+        "--cache-tokens",
+        action="store_true",
+        help="Persist tokenized id arrays next to each input, keyed by content hash, and reuse them.",
+    )
+    parser.add_argument(
+        "--order",
+        type=int,
+        default=1,
+        help="Also score Kneser-Ney n-gram models of orders 2..N and report perplexity_by_order.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="With N > 1, stream JSONL inputs in chunks over N processes (unigram only, memory bounded by chunk).",
+    )
+    parser.add_argument("--chunk-mb", type=int, default=64, help="Chunk size in MiB for --workers streaming.")
     args = parser.parse_args()
 
     train_path = Path(args.train)
@@ -72,19 +356,35 @@ def main() -> None:
     metrics_path = Path(args.metrics)
     metrics_path.parent.mkdir(parents=True, exist_ok=True)
 
-    train_records = list(iter_jsonl(train_path))
-    eval_records = list(iter_jsonl(eval_path))
+    if args.workers > 1:
+        if args.order > 1 or args.cache_tokens:
+            parser.error("--workers streaming supports the unigram model only (no --order/--cache-tokens)")
+        if detect_format(train_path) or detect_format(eval_path):
+            parser.error("--workers streaming reads JSONL inputs only")
+        metrics = {"train_file": str(train_path), "eval_file": str(eval_path)}
+        metrics.update(run_streaming(train_path, eval_path, args.workers, args.chunk_mb * 1024 * 1024))
+        metrics_path.write_text(json.dumps(metrics, ensure_ascii=False, indent=2), encoding="utf-8")
+        return
+
+    # Each file is tokenized at most once; build and evaluate share the id arrays.
+    train_corpus = load_corpus(train_path, cache=args.cache_tokens)
+    eval_corpus = load_corpus(eval_path, cache=args.cache_tokens)
 
-    counts, total = build_language_model(train_records)
-    train_eval = evaluate(train_records, counts, total)
-    eval_eval = evaluate(eval_records, counts, total)
+    model = build_language_model(train_corpus)
+    train_ids = model.model_ids(train_corpus)
+    ngram_models = [
+        KneserNeyModel(train_ids, train_corpus.offsets, len(model.vocab), order) for order in range(2, args.order + 1)
+    ]
+    train_eval = evaluate(train_corpus, model, ngram_models)
+    eval_eval = evaluate(eval_corpus, model, ngram_models)
 
     metrics = {
         "train_file": str(train_path),
         "eval_file": str(eval_path),
-        "train_records": len(train_records),
-        "eval_records": len(eval_records),
-        "vocab_size": len(counts),
+        "train_records": train_corpus.num_records,
+        "eval_records": eval_corpus.num_records,
+        "vocab_size": len(model.vocab),
+        "ngram_order": max(args.order, 1),
         "train": train_eval,
         "eval": eval_eval,
     }
@@ -3,17 +3,37 @@
 
 from __future__ import annotations
 
+import argparse
+import ctypes
+import functools
+import hashlib
 import json
+import os
+import shutil
 import subprocess
-from collections import defaultdict
+import sys
 from datetime import datetime
+from itertools import chain, islice
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable, Iterable, Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
 ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "scripts" / "ai"))
+
+from eval_store import BUCKETS, EvalStore  # noqa: E402
+from jsonl_io import iter_jsonl  # noqa: E402
+from sample_validator import validate_file, validate_rows  # noqa: E402
+from sequence_packing import load_tokenizer, pack_files  # noqa: E402
+
+TRAINING_SYNC_DIR = ROOT / "outputs" / "training_sync"
 RUN_ID = "run_20260209_132531"
-RUN_DIR = ROOT / "outputs" / "training_sync" / RUN_ID
-GAP_DIR = ROOT / "outputs" / "training_sync" / "2026-02-10-gap-analysis"
+GAP_DIR = TRAINING_SYNC_DIR / "2026-02-10-gap-analysis"
+EVAL_DB_FILE = TRAINING_SYNC_DIR / "eval_results.sqlite"
 
 STYLE_FILE = ROOT / "data" / "training" / "processed" / "style_sft.jsonl"
 WRITING_FILE = ROOT / "data" / "training" / "processed" / "writing_sft.jsonl"
@@ -24,11 +44,28 @@ WRITING_BENCH = ROOT / "data" / "training" / "eval" / "writing_benchmark.jsonl"
 STYLE_V3_FILE = ROOT / "data" / "training" / "processed" / "style_sft_v3.jsonl"
 WRITING_V3_FILE = ROOT / "data" / "training" / "processed" / "writing_sft_v3.jsonl"
 ALL_V3_FILE = ROOT / "data" / "training" / "processed" / "all_sft_v3.jsonl"
+ALL_V3_PACKED_FILE = ROOT / "data" / "training" / "packed" / "all_sft_v3.packed.jsonl"
 SHADOW_EVAL_FILE = ROOT / "data" / "training" / "eval" / "shadow_template_benchmark_v3.jsonl"
 ALL_BENCH_FILE = ROOT / "data" / "training" / "eval" / "all_benchmark_legacy.jsonl"
 
 PROCESSED_V3_DIR = ROOT / "data" / "training" / "processed_v3"
 
+SCRIPT_FILE = Path(__file__).resolve()
+# Step logic shared with scripts/ai; editing any of these invalidates every step like editing this script.
+CODE_FILES = [
+    SCRIPT_FILE,
+    *(
+        ROOT / "scripts" / "ai" / name
+        for name in ("jsonl_io.py", "sample_validator.py", "eval_store.py", "sequence_packing.py")
+    ),
+]
+BUILD_MANIFEST_FILE = ROOT / "data" / "training" / ".v3_build_manifest.json"
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+SHADOW_PER_LANE = 5
+MIRROR_METHODS = ("reflink", "hardlink", "symlink", "copy")
+SHARED_MIRROR_METHODS = ("hardlink", "symlink")
+FICLONE = 0x40049409
+
 STYLE_SYSTEM = "你是高校课程助教。请按以下结构回答：\n### 结论\n### 推导\n### 检查（单位/边界条件/极限情况）"
 WRITING_SYSTEM = "你是学术写作课程助教。请按以下结构回答：\n### 问题诊断\n### 改进建议\n### 规范说明"
 
@@ -496,21 +533,77 @@ WRITING_TOPICS: list[dict[str, Any]] = [
 
 
 def load_jsonl(path: Path) -> list[dict[str, Any]]:
-    rows: list[dict[str, Any]] = []
-    with path.open("r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            rows.append(json.loads(line))
-    return rows
+    return list(iter_jsonl(path))
 
 
-def write_jsonl(path: Path, rows: list[dict[str, Any]]) -> None:
+def write_jsonl(path: Path, rows: Iterable[dict[str, Any]]) -> None:
+    # Write-then-replace so a mirrored (hard-linked) twin is never rewritten in place.
     path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w", encoding="utf-8") as f:
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
         for row in rows:
             f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+
+
+def concat_files(path: Path, parts: list[Path]) -> None:
+    """Write path as the byte concatenation of already-serialized JSONL parts."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with tmp_path.open("wb") as dst:
+        for part in parts:
+            with part.open("rb") as src:
+                shutil.copyfileobj(src, dst, HASH_CHUNK_SIZE)
+    os.replace(tmp_path, path)
+
+
+def reflink(src: Path, dst: Path) -> None:
+    """Copy-on-write clone (Linux FICLONE, macOS clonefile); raises OSError if unsupported."""
+    if sys.platform == "darwin":
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.clonefile(os.fsencode(src), os.fsencode(dst), 0) != 0:
+            raise OSError(ctypes.get_errno(), "clonefile failed")
+        return
+    if fcntl is None:
+        raise OSError("reflink not supported on this platform")
+    with src.open("rb") as s, dst.open("wb") as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            dst.unlink()
+            raise
+
+
+def mirror_file(src: Path, dst: Path, mode: str = "auto", source: bool = False) -> str:
+    """Expose src's bytes at dst without re-serializing; return the method used.
+
+    auto tries reflink, hardlink, symlink, then falls back to a plain copy.
+    A source input (data this pipeline does not regenerate) is never hard- or
+    symlinked: an in-place write to the mirror would silently change the source
+    dataset, so those methods become a copy.
+    """
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    methods = MIRROR_METHODS if mode == "auto" else (mode,)
+    if source:
+        methods = tuple(dict.fromkeys("copy" if method in SHARED_MIRROR_METHODS else method for method in methods))
+    for method in methods:
+        if dst.is_symlink() or dst.exists():
+            dst.unlink()
+        try:
+            if method == "reflink":
+                reflink(src, dst)
+            elif method == "hardlink":
+                os.link(src, dst)
+            elif method == "symlink":
+                os.symlink(os.path.relpath(src, dst.parent), dst)
+            else:
+                shutil.copyfile(src, dst)
+            return method
+        except OSError:
+            if mode != "auto":
+                raise
+    raise OSError(f"could not mirror {src} to {dst}")
 
 
 def build_style_sample(i: int, topic: dict[str, str]) -> dict[str, Any]:
@@ -573,70 +666,26 @@ def build_writing_sample(i: int, topic: dict[str, Any]) -> dict[str, Any]:
     }
 
 
-def validate_samples(rows: list[dict[str, Any]], lane: str) -> dict[str, Any]:
-    required_top = ["id", "mode", "messages", "meta"]
-    miss_fields: list[str] = []
-    format_fail: list[str] = []
-
-    style_need = ["### 结论", "### 推导", "### 检查（单位/边界条件/极限情况）"]
-    writing_need = ["### 问题诊断", "### 改进建议", "### 规范说明"]
-
-    for row in rows:
-        sid = row.get("id", "unknown")
-        for field in required_top:
-            if field not in row:
-                miss_fields.append(f"{sid}:{field}")
-        msgs = row.get("messages", [])
-        if len(msgs) < 3:
-            miss_fields.append(f"{sid}:messages_len")
-            continue
-        roles = [m.get("role") for m in msgs[:3]]
-        if roles != ["system", "user", "assistant"]:
-            miss_fields.append(f"{sid}:roles")
-        answer = msgs[2].get("content", "")
-        need = style_need if lane == "style" else writing_need
-        if not all(tag in answer for tag in need):
-            format_fail.append(sid)
-
-    total = len(rows)
-    parse_ok = True
-    field_ok = len(miss_fields) == 0
-    template_hit = total - len(format_fail)
-    return {
-        "total": total,
-        "parse_ok": parse_ok,
-        "field_complete": field_ok,
-        "missing_fields": miss_fields,
-        "template_hit_count": template_hit,
-        "template_hit_rate": 0.0 if total == 0 else template_hit / total,
-        "template_fail_ids": format_fail,
-    }
+def validate_samples(rows: Iterable[dict[str, Any]], lane: str) -> dict[str, Any]:
+    return validate_rows(rows, lane)
+
 
+def analyze_eval_failures(
+    store: EvalStore, run_id: str = RUN_ID, compare_run: str | None = None
+) -> tuple[dict[str, Any], str]:
+    # Reports are ingested once into the indexed store; buckets are read back by query.
+    run_dir = TRAINING_SYNC_DIR / run_id
+    for lane in ("all", "style"):
+        report_path = run_dir / f"eval_report_{lane}.json"
+        if not report_path.exists():
+            raise FileNotFoundError(f"Missing eval report: {report_path}")
+    store.ingest_run(run_dir, run_id)
+    buckets = {bucket: store.bucket_ids(run_id, "all", bucket) for bucket in BUCKETS}
+    style_format_fail = store.bucket_ids(run_id, "style", "template_format_fail")
+    all_ids = store.failed_ids(run_id, "all")
 
-def analyze_eval_failures() -> tuple[dict[str, Any], str]:
-    all_report = json.loads((RUN_DIR / "eval_report_all.json").read_text(encoding="utf-8"))
-    style_report = json.loads((RUN_DIR / "eval_report_style.json").read_text(encoding="utf-8"))
-
-    buckets = defaultdict(list)
-    for d in all_report.get("details", []):
-        sid = d.get("id", "unknown")
-        res = d.get("result", {})
-        if res.get("key_points_total", 0) > 0 and res.get("key_points_hit", 0) < res.get("key_points_total", 0):
-            buckets["key_points_miss"].append(sid)
-        if not bool(res.get("response_format", False)):
-            buckets["template_format_fail"].append(sid)
-        if (res.get("refused_pred") is not None and res.get("refused_expected") is not None and res.get("refused_pred") != res.get("refused_expected")):
-            buckets["refusal_mismatch"].append(sid)
-
-    style_format_fail = []
-    for d in style_report.get("details", []):
-        sid = d.get("id", "unknown")
-        if not bool(d.get("result", {}).get("response_format", False)):
-            style_format_fail.append(sid)
-
-    all_ids = sorted({sid for arr in buckets.values() for sid in arr})
     payload = {
-        "run_id": RUN_ID,
+        "run_id": run_id,
         "generated_at": datetime.utcnow().isoformat() + "Z",
         "all": {
             "key_points_miss": buckets["key_points_miss"],
@@ -651,7 +700,7 @@ def analyze_eval_failures() -> tuple[dict[str, Any], str]:
     }
 
     matrix = [
-        "# V3 Gap Analysis (run_20260209_132531)",
+        f"# V3 Gap Analysis ({run_id})",
         "",
         "## All 阶段失败分桶",
         f"- key_points_miss: {len(buckets['key_points_miss'])}",
@@ -674,28 +723,115 @@ def analyze_eval_failures() -> tuple[dict[str, Any], str]:
         "### style format fail IDs",
         ", ".join(style_format_fail) or "(none)",
     ]
+
+    if compare_run:
+        compare_dir = TRAINING_SYNC_DIR / compare_run
+        if compare_dir.is_dir():
+            store.ingest_run(compare_dir, compare_run)
+        if not store.has_report(compare_run, "all"):
+            raise FileNotFoundError(
+                f"Compare run {compare_run} has no eval_report_all.json in {compare_dir} or in {store.path}"
+            )
+        diff = store.diff(run_id, compare_run, "all")
+        payload["all"]["since"] = diff
+        matrix += [
+            "",
+            f"## 相对 {compare_run} 的变化",
+            f"- newly_failing: {len(diff['newly_failing'])}",
+            f"- fixed: {len(diff['fixed'])}",
+            "",
+            "### newly failing IDs",
+            ", ".join(diff["newly_failing"]) or "(none)",
+            "",
+            "### fixed IDs",
+            ", ".join(diff["fixed"]) or "(none)",
+        ]
     return payload, "\n".join(matrix) + "\n"
 
 
-def git_value(args: list[str]) -> str:
-    return subprocess.check_output(args, text=True, cwd=ROOT).strip()
+def git_dirs(repo: Path) -> tuple[Path, Path]:
+    """(git dir, common dir) for a checkout; ``.git`` may be a gitdir file (worktrees, submodules).
+
+    The returned git dir does not exist when ``repo`` has no ``.git``.
+    """
+    git_dir = repo / ".git"
+    if git_dir.is_file():
+        git_dir = (repo / git_dir.read_text(encoding="utf-8").split("gitdir:", 1)[1].strip()).resolve()
+    common = git_dir / "commondir"
+    common_dir = (git_dir / common.read_text(encoding="utf-8").strip()).resolve() if common.is_file() else git_dir
+    return git_dir, common_dir
 
 
-def make_baseline_manifest() -> str:
-    root_branch = git_value(["git", "branch", "--show-current"])
-    root_commit = git_value(["git", "rev-parse", "HEAD"])
-    code_branch = subprocess.check_output(["git", "branch", "--show-current"], text=True, cwd=ROOT / "code").strip()
-    code_commit = subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, cwd=ROOT / "code").strip()
+def resolve_ref(git_dir: Path, common_dir: Path, ref: str) -> str | None:
+    for base in (git_dir, common_dir):
+        try:
+            return (base / ref).read_text(encoding="utf-8").strip()
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+    try:
+        packed = (common_dir / "packed-refs").read_text(encoding="utf-8")
+    except FileNotFoundError:
+        return None
+    for line in packed.splitlines():
+        sha, _, name = line.partition(" ")
+        if name == ref and not line.startswith(("#", "^")):
+            return sha
+    return None
 
+
+def read_head(repo: Path) -> tuple[str, str]:
+    """(branch, commit) of a checkout, read from .git without spawning git.
+
+    Falls back to a single ``git rev-parse`` when the refs cannot be read
+    directly (reftable repos, symbolic refs to refs, unborn branches, or no
+    ``.git`` at all, e.g. an uninitialized submodule, where git resolves the
+    enclosing repository). Returns ``("", "unknown")`` if git cannot either.
+    """
+    git_dir, common_dir = git_dirs(repo)
+    if (git_dir / "HEAD").is_file() and not (common_dir / "reftable").exists():
+        head = (git_dir / "HEAD").read_text(encoding="utf-8").strip()
+        if not head.startswith("ref:"):
+            return "", head
+        ref = head[4:].strip()
+        commit = resolve_ref(git_dir, common_dir, ref)
+        if commit and not commit.startswith("ref:"):
+            return ref.removeprefix("refs/heads/"), commit
+    try:
+        out = subprocess.check_output(
+            ["git", "rev-parse", "HEAD", "--symbolic-full-name", "HEAD"],
+            text=True,
+            cwd=repo,
+            stderr=subprocess.DEVNULL,
+        ).split()
+    except (OSError, subprocess.CalledProcessError):
+        return "", "unknown"
+    commit, ref = out[0], out[1]
+    return ("" if ref == "HEAD" else ref.removeprefix("refs/heads/")), commit
+
+
+@functools.cache
+def repository_state() -> dict[str, str]:
+    """Branch/commit of the root repo and code/, computed once per pipeline run."""
+    root_branch, root_commit = read_head(ROOT)
+    code_branch, code_commit = read_head(ROOT / "code")
+    return {
+        "root_branch": root_branch,
+        "root_commit": root_commit,
+        "code_branch": code_branch,
+        "code_commit": code_commit,
+    }
+
+
+def make_baseline_manifest(state: dict[str, str], run_id: str = RUN_ID) -> str:
     lines = [
         "# V3 Baseline Manifest",
         "",
         f"- generated_at: {datetime.utcnow().isoformat()}Z",
-        f"- baseline_run_id: {RUN_ID}",
-        f"- root_branch: {root_branch}",
-        f"- root_commit: {root_commit}",
-        f"- code_branch: {code_branch}",
-        f"- code_commit: {code_commit}",
+        f"- baseline_run_id: {run_id}",
+        f"- root_branch: {state['root_branch']}",
+        f"- root_commit: {state['root_commit']}",
+        f"- code_branch: {state['code_branch']}",
+        f"- code_commit: {state['code_commit']}",
         "",
         "## Fixed Inputs",
         f"- {STYLE_FILE}",
@@ -714,62 +850,71 @@ def make_baseline_manifest() -> str:
     return "\n".join(lines) + "\n"
 
 
-def main() -> None:
-    GAP_DIR.mkdir(parents=True, exist_ok=True)
-
-    style_base = load_jsonl(STYLE_FILE)
-    writing_base = load_jsonl(WRITING_FILE)
-
+def build_v3_rows() -> dict[str, list[dict[str, Any]]]:
     style_new = [build_style_sample(i + 1, t) for i, t in enumerate(STYLE_TOPICS)]
     writing_new = [build_writing_sample(i + 1, t) for i, t in enumerate(WRITING_TOPICS)]
 
     if len(style_new) != 24 or len(writing_new) != 18:
         raise RuntimeError("augmentation counts mismatch")
 
-    style_v3 = style_base + style_new
-    writing_v3 = writing_base + writing_new
-    all_v3 = style_v3 + writing_v3
-
-    write_jsonl(STYLE_V3_FILE, style_v3)
-    write_jsonl(WRITING_V3_FILE, writing_v3)
-    write_jsonl(ALL_V3_FILE, all_v3)
-
-    # Build a non-gating shadow eval set (5 style + 5 writing).
-    shadow_eval: list[dict[str, Any]] = []
-    for i, row in enumerate(style_new[:5], 1):
-        copied = json.loads(json.dumps(row, ensure_ascii=False))
-        copied["id"] = f"shadow-style-{i:03d}"
-        copied["meta"]["purpose"] = "shadow_eval"
-        shadow_eval.append(copied)
-    for i, row in enumerate(writing_new[:5], 1):
-        copied = json.loads(json.dumps(row, ensure_ascii=False))
-        copied["id"] = f"shadow-writing-{i:03d}"
-        copied["meta"]["purpose"] = "shadow_eval"
-        shadow_eval.append(copied)
-    write_jsonl(SHADOW_EVAL_FILE, shadow_eval)
-
-    # Keep an explicit merged benchmark for all-stage post-eval.
-    merged_bench = load_jsonl(STYLE_BENCH) + load_jsonl(WRITING_BENCH)
-    write_jsonl(ALL_BENCH_FILE, merged_bench)
-
-    # Create processed_v3 directory for run_train DATA_BASE override.
-    PROCESSED_V3_DIR.mkdir(parents=True, exist_ok=True)
-    write_jsonl(PROCESSED_V3_DIR / "style_sft.jsonl", style_v3)
-    write_jsonl(PROCESSED_V3_DIR / "writing_sft.jsonl", writing_v3)
-    write_jsonl(PROCESSED_V3_DIR / "all_sft.jsonl", all_v3)
-    style_sample = load_jsonl(STYLE_SAMPLE_FILE)
-    write_jsonl(PROCESSED_V3_DIR / "style_sft_sample.jsonl", style_sample)
-
-    # Gap analysis outputs.
-    failure_ids, matrix_md = analyze_eval_failures()
+    style_v3 = load_jsonl(STYLE_FILE) + style_new
+    writing_v3 = load_jsonl(WRITING_FILE) + writing_new
+    return {
+        "style_new": style_new,
+        "writing_new": writing_new,
+        "style_v3": style_v3,
+        "writing_v3": writing_v3,
+        "all_v3": style_v3 + writing_v3,
+    }
+
+
+def iter_shadow_rows(rows: Iterable[dict[str, Any]], lane: str) -> Iterator[dict[str, Any]]:
+    """Lazily re-tag rows as shadow-eval samples.
+
+    Only the top-level dict and ``meta`` are rebuilt; ``messages`` is shared
+    with the source row, so nothing is deep-copied or round-tripped.
+    """
+    for i, row in enumerate(rows, 1):
+        yield {**row, "id": f"shadow-{lane}-{i:03d}", "meta": {**row.get("meta", {}), "purpose": "shadow_eval"}}
+
+
+def build_shadow_eval(
+    style_rows: Iterable[dict[str, Any]], writing_rows: Iterable[dict[str, Any]]
+) -> Iterator[dict[str, Any]]:
+    """Non-gating shadow eval stream (5 style + 5 writing), pulled lazily from the sources."""
+    return chain(
+        iter_shadow_rows(islice(style_rows, SHADOW_PER_LANE), "style"),
+        iter_shadow_rows(islice(writing_rows, SHADOW_PER_LANE), "writing"),
+    )
+
+
+def write_gap_analysis(run_id: str = RUN_ID, compare_run: str | None = None, db_path: Path = EVAL_DB_FILE) -> None:
+    with EvalStore(db_path) as store:
+        failure_ids, matrix_md = analyze_eval_failures(store, run_id, compare_run)
     (GAP_DIR / "all_failure_ids.json").write_text(json.dumps(failure_ids, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
     (GAP_DIR / "all_failure_matrix.md").write_text(matrix_md, encoding="utf-8")
 
-    # Data quality gate report.
-    val_style = validate_samples(style_v3, lane="style")
-    val_writing = validate_samples(writing_v3, lane="writing")
-    val_shadow_style = validate_samples(shadow_eval[:5], lane="style")
-    val_shadow_writing = validate_samples(shadow_eval[5:], lane="writing")
+
+def iter_style_new() -> Iterator[dict[str, Any]]:
+    return (build_style_sample(i + 1, t) for i, t in enumerate(STYLE_TOPICS))
+
+
+def iter_writing_new() -> Iterator[dict[str, Any]]:
+    return (build_writing_sample(i + 1, t) for i, t in enumerate(WRITING_TOPICS))
+
+
+def write_data_validation(workers: int = 1) -> None:
+    # The written V3 files are streamed (and chunked across workers) instead of held in memory.
+    val_style = validate_file(STYLE_V3_FILE, "style", workers=workers)
+    val_writing = validate_file(WRITING_V3_FILE, "writing", workers=workers)
+    val_shadow_style = validate_samples(iter_shadow_rows(islice(iter_style_new(), SHADOW_PER_LANE), "style"), "style")
+    val_shadow_writing = validate_samples(
+        iter_shadow_rows(islice(iter_writing_new(), SHADOW_PER_LANE), "writing"), "writing"
+    )
+    style_total = val_style["total"]
+    writing_total = val_writing["total"]
+    all_total = style_total + writing_total
+    shadow_total = val_shadow_style["total"] + val_shadow_writing["total"]
 
     quality = {
         "generated_at": datetime.utcnow().isoformat() + "Z",
@@ -777,14 +922,14 @@ def main() -> None:
         "writing_sft_v3": val_writing,
         "shadow_eval_style": val_shadow_style,
         "shadow_eval_writing": val_shadow_writing,
-        "all_sft_v3_count": len(all_v3),
+        "all_sft_v3_count": all_total,
         "targets": {
             "style_added": 24,
             "writing_added": 18,
-            "style_total": len(style_v3),
-            "writing_total": len(writing_v3),
-            "all_total": len(all_v3),
-            "shadow_eval_total": len(shadow_eval),
+            "style_total": style_total,
+            "writing_total": writing_total,
+            "all_total": all_total,
+            "shadow_eval_total": shadow_total,
         },
     }
     (GAP_DIR / "data_v3_validation.json").write_text(json.dumps(quality, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
@@ -792,10 +937,10 @@ def main() -> None:
     quality_md = [
         "# V3 Data Validation",
         "",
-        f"- style_sft_v3: {len(style_v3)} samples",
-        f"- writing_sft_v3: {len(writing_v3)} samples",
-        f"- all_sft_v3: {len(all_v3)} samples",
-        f"- shadow_eval: {len(shadow_eval)} samples",
+        f"- style_sft_v3: {style_total} samples",
+        f"- writing_sft_v3: {writing_total} samples",
+        f"- all_sft_v3: {all_total} samples",
+        f"- shadow_eval: {shadow_total} samples",
         "",
         "## Gate Results",
         f"- style parse_ok: {val_style['parse_ok']}",
@@ -809,7 +954,244 @@ def main() -> None:
     ]
     (GAP_DIR / "data_v3_validation.md").write_text("\n".join(quality_md) + "\n", encoding="utf-8")
 
-    (GAP_DIR / "baseline_manifest.md").write_text(make_baseline_manifest(), encoding="utf-8")
+
+class BuildManifest:
+    """Content-hash manifest of each build step's inputs and outputs.
+
+    A step is skipped when its input hashes and extra key match the last
+    recorded run and its outputs still hold the bytes that run wrote. File
+    hashes are cached by (size, mtime_ns), so a no-change run only stats files.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            data = {}
+        self.files: dict[str, dict[str, Any]] = data.get("files", {})
+        self.steps: dict[str, dict[str, Any]] = data.get("steps", {})
+
+    @staticmethod
+    def key(path: Path) -> str:
+        try:
+            return str(path.relative_to(ROOT))
+        except ValueError:
+            return str(path)
+
+    def file_hash(self, path: Path) -> str | None:
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        key = self.key(path)
+        cached = self.files.get(key)
+        if cached and cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns:
+            return cached["sha256"]
+        hasher = hashlib.sha256()
+        with path.open("rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                hasher.update(chunk)
+        digest = hasher.hexdigest()
+        self.files[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+        return digest
+
+    def hashes(self, paths: list[Path]) -> dict[str, str | None]:
+        return {self.key(path): self.file_hash(path) for path in paths}
+
+    def is_fresh(self, step: str, inputs: list[Path], outputs: list[Path], extra: str) -> bool:
+        record = self.steps.get(step)
+        if not record or record.get("extra") != extra:
+            return False
+        if record.get("inputs") != self.hashes(inputs):
+            return False
+        current_outputs = self.hashes(outputs)
+        return None not in current_outputs.values() and record.get("outputs") == current_outputs
+
+    def record(self, step: str, inputs: list[Path], outputs: list[Path], extra: str) -> None:
+        self.steps[step] = {"inputs": self.hashes(inputs), "outputs": self.hashes(outputs), "extra": extra}
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        payload = {"files": self.files, "steps": self.steps}
+        self.path.write_text(json.dumps(payload, ensure_ascii=False, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+
+
+def run_step(
+    manifest: BuildManifest,
+    name: str,
+    inputs: list[Path],
+    outputs: list[Path],
+    build: Callable[[], None],
+    force: bool = False,
+    extra: str = "",
+) -> bool:
+    """Run build() unless the step is fresh; every step also depends on CODE_FILES."""
+    inputs = [*CODE_FILES, *inputs]
+    if not force and manifest.is_fresh(name, inputs, outputs, extra):
+        print(f"[SKIP] {name} (inputs unchanged)")
+        return False
+    build()
+    manifest.record(name, inputs, outputs, extra)
+    print(f"[BUILD] {name}")
+    return True
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate V3 training assets and gap analysis artifacts.")
+    parser.add_argument("--force", action="store_true", help="Rebuild every artifact even if its inputs are unchanged.")
+    parser.add_argument(
+        "--mirror-mode",
+        choices=("auto",) + MIRROR_METHODS,
+        default="auto",
+        help=(
+            "How processed_v3/ mirrors the already-written V3 files (auto: reflink > hardlink > symlink > copy); "
+            "source inputs are only reflinked or copied."
+        ),
+    )
+    parser.add_argument("--workers", type=int, default=1, help="Processes used to validate the V3 files.")
+    parser.add_argument("--run-id", default=RUN_ID, help="Training run whose eval reports feed the gap analysis.")
+    parser.add_argument("--compare-run", default=None, help="Also report samples newly failing since this run.")
+    parser.add_argument("--eval-db", type=Path, default=EVAL_DB_FILE, help="SQLite eval results store.")
+    parser.add_argument(
+        "--pack-tokenizer",
+        default=None,
+        help="Tokenizer name/path; also writes all_sft_v3.packed.jsonl (sequence-packed style + writing V3).",
+    )
+    parser.add_argument("--pack-max-length", type=int, default=2048, help="Tokens per packed sequence.")
+    args = parser.parse_args()
+
+    GAP_DIR.mkdir(parents=True, exist_ok=True)
+    manifest = BuildManifest(BUILD_MANIFEST_FILE)
+
+    cache: dict[str, Any] = {}
+
+    def rows() -> dict[str, list[dict[str, Any]]]:
+        if "rows" not in cache:
+            cache["rows"] = build_v3_rows()
+        return cache["rows"]
+
+    def mirror(src: Path, dst: Path, source: bool = False) -> None:
+        method = mirror_file(src, dst, args.mirror_mode, source=source)
+        print(f"[MIRROR] {dst} <- {src.name} ({method})")
+
+    def write_sft_v3() -> None:
+        # Each dataset is serialized once; all_v3 is the byte concatenation of the two lanes.
+        write_jsonl(STYLE_V3_FILE, rows()["style_v3"])
+        write_jsonl(WRITING_V3_FILE, rows()["writing_v3"])
+        concat_files(ALL_V3_FILE, [STYLE_V3_FILE, WRITING_V3_FILE])
+        # processed_v3 directory for run_train DATA_BASE override.
+        mirror(STYLE_V3_FILE, PROCESSED_V3_DIR / "style_sft.jsonl")
+        mirror(WRITING_V3_FILE, PROCESSED_V3_DIR / "writing_sft.jsonl")
+        mirror(ALL_V3_FILE, PROCESSED_V3_DIR / "all_sft.jsonl")
+
+    gap_outputs = [GAP_DIR / "all_failure_ids.json", GAP_DIR / "all_failure_matrix.md"]
+    run_dir = TRAINING_SYNC_DIR / args.run_id
+    eval_reports = [run_dir / "eval_report_all.json", run_dir / "eval_report_style.json"]
+    if args.compare_run:
+        eval_reports += sorted((TRAINING_SYNC_DIR / args.compare_run).glob("eval_report_*.json"))
+    # (name, inputs, outputs, build, extra): extra holds the CLI options that change a step's output.
+    steps: list[tuple[str, list[Path], list[Path], Callable[[], None], str]] = [
+        (
+            "sft_v3",
+            [STYLE_FILE, WRITING_FILE],
+            [
+                STYLE_V3_FILE,
+                WRITING_V3_FILE,
+                ALL_V3_FILE,
+                PROCESSED_V3_DIR / "style_sft.jsonl",
+                PROCESSED_V3_DIR / "writing_sft.jsonl",
+                PROCESSED_V3_DIR / "all_sft.jsonl",
+            ],
+            write_sft_v3,
+            args.mirror_mode,
+        ),
+        (
+            "shadow_eval",
+            [],
+            [SHADOW_EVAL_FILE],
+            lambda: write_jsonl(
+                SHADOW_EVAL_FILE,
+                build_shadow_eval(iter_style_new(), iter_writing_new()),
+            ),
+            "",
+        ),
+        (
+            # Explicit merged benchmark for all-stage post-eval.
+            "merged_benchmark",
+            [STYLE_BENCH, WRITING_BENCH],
+            [ALL_BENCH_FILE],
+            lambda: write_jsonl(ALL_BENCH_FILE, load_jsonl(STYLE_BENCH) + load_jsonl(WRITING_BENCH)),
+            "",
+        ),
+        (
+            "style_sample_v3",
+            [STYLE_SAMPLE_FILE],
+            [PROCESSED_V3_DIR / "style_sft_sample.jsonl"],
+            lambda: mirror(STYLE_SAMPLE_FILE, PROCESSED_V3_DIR / "style_sft_sample.jsonl", source=True),
+            args.mirror_mode,
+        ),
+        (
+            "gap_analysis",
+            eval_reports,
+            gap_outputs,
+            lambda: write_gap_analysis(args.run_id, args.compare_run, args.eval_db),
+            json.dumps(
+                {"run_id": args.run_id, "compare_run": args.compare_run, "eval_db": str(args.eval_db)},
+                sort_keys=True,
+            ),
+        ),
+        (
+            "data_validation",
+            [STYLE_V3_FILE, WRITING_V3_FILE],
+            [GAP_DIR / "data_v3_validation.json", GAP_DIR / "data_v3_validation.md"],
+            lambda: write_data_validation(args.workers),
+            "",
+        ),
+    ]
+
+    try:
+        for name, inputs, outputs, build, extra in steps:
+            run_step(manifest, name, inputs, outputs, build, force=args.force, extra=extra)
+
+        if args.pack_tokenizer:
+
+            def write_packed_v3() -> None:
+                report = pack_files(
+                    [STYLE_V3_FILE, WRITING_V3_FILE],
+                    ALL_V3_PACKED_FILE,
+                    load_tokenizer(args.pack_tokenizer),
+                    args.pack_max_length,
+                    id_prefix="v3-pack",
+                )
+                packing = report["packing"]
+                print(f"[PACK] {packing['unpacked_sequences']} rows -> {packing['packed_sequences']} sequences")
+
+            run_step(
+                manifest,
+                "sft_v3_packed",
+                [STYLE_V3_FILE, WRITING_V3_FILE],
+                [ALL_V3_PACKED_FILE],
+                write_packed_v3,
+                force=args.force,
+                extra=f"{args.pack_tokenizer}|{args.pack_max_length}",
+            )
+
+        # The baseline manifest records repository state and the baseline run, so those are its key.
+        repo_state = repository_state()
+        run_step(
+            manifest,
+            "baseline_manifest",
+            [],
+            [GAP_DIR / "baseline_manifest.md"],
+            lambda: (GAP_DIR / "baseline_manifest.md").write_text(
+                make_baseline_manifest(repo_state, args.run_id), encoding="utf-8"
+            ),
+            force=args.force,
+            extra=json.dumps({**repo_state, "run_id": args.run_id}, sort_keys=True),
+        )
+    finally:
+        manifest.save()
 
     print("[OK] generated V3 assets")
     print(STYLE_V3_FILE)